@@ -0,0 +1,4 @@
+""" Benchmarks of the loaders against synthetic inputs
+
+See :mod:`benchmarks.run`.
+"""
@@ -0,0 +1,276 @@
+""" Synthetic inputs for the loaders at several scales
+
+The external sources, which are not distributed with irdata (COW and
+KSG state lists, NMC, Polity), are generated from random states with
+one or two spells of system membership. The files distributed in
+irdata/data (MID, direct contiguity, KSG Polity, the COW war list)
+are copied ``scale`` times, with the state codes, dispute numbers or
+war numbers of each copy offset by :data:`OFFSET` so that keys stay
+unique.
+
+External files are written in the layout of a data directory
+downloaded with :mod:`irdata.download`, so the ``load_all`` functions
+of their loaders can read them. Copies of packaged files are written
+to ``data/`` under the same names as in irdata/data.
+
+"""
+import os
+import re
+import csv
+import random
+import string
+import datetime
+import zipfile
+import pkgutil
+import itertools
+from os import path
+from cStringIO import StringIO
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+from irdata import model
+from irdata.load import cow_states, ksg_states, nmc, polity
+
+STATES = 250
+""" Number of COW states at scale 1 """
+
+KSG_STATES = 200
+""" Number of KSG states at scale 1 """
+
+KSG_MICROSTATES = 50
+""" Number of KSG microstates at scale 1 """
+
+OFFSET = 100000
+""" Offset of the keys of each copy of a packaged file """
+
+XLS_MAX_ROWS = 65535
+""" Rows in an xls worksheet, not counting the header """
+
+FIRST_YEAR = 1816
+LAST_YEAR = 2008
+
+def _abb(i):
+    """ Three letter abbreviation of a state number """
+    letters = string.ascii_uppercase
+    return ''.join(letters[(i // 26 ** k) % 26] for k in (2, 1, 0))
+
+def _makedirs(filename):
+    dirname = path.dirname(filename)
+    if not path.exists(dirname):
+        os.makedirs(dirname)
+    return filename
+
+def states(n, rand, first=1):
+    """ Random states
+
+    :param n: number of states
+    :param rand: :class:`random.Random`
+    :param first: first state code
+    :return: list of ``(ccode, abbreviation, name, spells)``, where
+      spells is a list of ``(start_date, end_date)``.
+    """
+    out = []
+    for ccode in range(first, first + n):
+        spells = []
+        start = rand.randint(FIRST_YEAR, LAST_YEAR)
+        while start <= LAST_YEAR:
+            end = rand.randint(start, LAST_YEAR)
+            spells.append((datetime.date(start, rand.randint(1, 12),
+                                         rand.randint(1, 28)),
+                           datetime.date(end, rand.randint(1, 12),
+                                         rand.randint(1, 28))))
+            if rand.random() > 0.2 or len(spells) == 2:
+                break
+            start = end + 2
+        out.append((ccode, _abb(ccode), u'State %d' % ccode, spells))
+    return out
+
+def _state_years(rows):
+    for ccode, abb, name, spells in rows:
+        for start, end in spells:
+            for year in range(start.year, end.year + 1):
+                yield ccode, abb, name, year
+
+def write_cow_states(dirname, rows):
+    """ COW state list and major powers CSV files """
+    header = ['StateAbb', 'CCode', 'StateNme', 'StYear', 'StMonth', 'StDay',
+              'EndYear', 'EndMonth', 'EndDay', 'Version']
+    majors = rows[:max(len(rows) // 20, 1)]
+    for src, data in zip(cow_states.SOURCES, (rows, majors)):
+        with open(_makedirs(path.join(dirname, src)), 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for ccode, abb, name, spells in data:
+                for start, end in spells:
+                    writer.writerow([abb, ccode, name,
+                                     start.year, start.month, start.day,
+                                     end.year, end.month, end.day, 2008])
+
+def write_ksg_states(dirname, rows, microstates):
+    """ KSG tab-delimited state lists """
+    for src, data in zip(ksg_states.SOURCES, (rows, microstates)):
+        with open(_makedirs(path.join(dirname, src)), 'wb') as f:
+            for ccode, abb, name, spells in data:
+                for start, end in spells:
+                    f.write('\t'.join([str(ccode), abb, name] +
+                                      ['%02d:%02d:%d' % (x.day, x.month, x.year)
+                                       for x in (start, end)]))
+                    f.write('\n')
+
+def write_nmc(dirname, rows, rand):
+    """ NMC zip file with one row per state-year """
+    header = ['stateabb', 'ccode', 'year', 'irst', 'milex', 'milper', 'pec',
+              'tpop', 'upop', 'cinc', 'version', 'irstqualitycode',
+              'pecqualitycode', 'tpopqualitycode', 'upopqualitycode',
+              'statenme']
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for ccode, abb, name, year in _state_years(rows):
+        writer.writerow([abb, ccode, year, rand.randint(0, 100000),
+                         rand.randint(0, 1000000), rand.randint(0, 10000),
+                         rand.randint(0, 100000), rand.randint(0, 1000000),
+                         rand.randint(0, 100000), '%.6f' % rand.random(), 4,
+                         'A', 'A', 'A', 'A', name])
+    filename = _makedirs(path.join(dirname, nmc.SOURCES[0]))
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('NMC_Supplement_v4_0.csv', buf.getvalue())
+
+def _write_xls(filename, header, rows):
+    book = xlwt.Workbook()
+    sheet = book.add_sheet('Sheet1')
+    for j, x in enumerate(header):
+        sheet.write(0, j, x)
+    for i, row in enumerate(rows, 1):
+        for j, x in enumerate(row):
+            sheet.write(i, j, x)
+    book.save(_makedirs(filename))
+
+def write_polity(dirname, rows, rand):
+    """ Polity state-year and polity case xls files
+
+    Requires xlwt. Each file is cut at :data:`XLS_MAX_ROWS` rows.
+    """
+    if xlwt is None:
+        raise RuntimeError("writing the Polity xls files requires xlwt")
+    cols = [c.name for c in model.PolityStateYear.__table__.c]
+    def state_years():
+        for ccode, abb, name, year in _state_years(rows):
+            x = dict((k, rand.randint(-10, 10)) for k in cols)
+            x.update(cyear=ccode * 10000 + year, ccode=ccode, year=year,
+                     flag=0, scode=abb, country=name,
+                     emonth=rand.randint(1, 12), bmonth=rand.randint(1, 12),
+                     eday=rand.randint(1, 28), bday=rand.randint(1, 28))
+            yield [x[k] for k in cols + ['scode', 'country']]
+    _write_xls(path.join(dirname, polity.SOURCES[0]), cols + ['scode', 'country'],
+               itertools.islice(state_years(), XLS_MAX_ROWS))
+    values = ['persist', 'democ', 'autoc', 'polity', 'xrreg', 'xrcomp',
+              'xropen', 'xconst', 'parreg', 'parcomp', 'exrec', 'exconst',
+              'polcomp']
+    header = (['ccode', 'scode', 'country', 'present'] + values +
+              ['bday', 'bmonth', 'byear', 'eday', 'emonth', 'eyear'])
+    def cases():
+        for ccode, abb, name, spells in rows:
+            for start, end in spells:
+                ## One case per decade of the spell
+                for year in range(start.year, end.year + 1, 10):
+                    last = min(year + 9, end.year)
+                    yield ([ccode, abb, name, '1' if last == LAST_YEAR else '0'] +
+                           [rand.randint(-10, 10) for x in values] +
+                           [1, 1, year, 31, 12, last])
+    _write_xls(path.join(dirname, polity.SOURCES[1]), header,
+               itertools.islice(cases(), XLS_MAX_ROWS))
+
+def _copies(name, scale, offset_row):
+    """ Write the rows of a packaged CSV file scale times
+
+    :param offset_row: function of a row and an offset which returns
+      the row with its keys offset
+    """
+    ## The contiguity file has \r line endings
+    reader = csv.reader(pkgutil.get_data("irdata", "data/%s" % name).splitlines())
+    header = reader.next()
+    rows = list(reader)
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for k in range(scale):
+        writer.writerows(offset_row(row, k * OFFSET) for row in rows)
+    return buf.getvalue()
+
+def _offset(row, columns, offset):
+    row = list(row)
+    for i in columns:
+        row[i] = str(int(row[i]) + offset)
+    return row
+
+def _mida_row(row, offset):
+    row = _offset(row, [0], offset)
+    ## Link1-Link3 are dispute numbers or war numbers ending in W
+    for i in (18, 19, 20):
+        if row[i] not in ('', '0') and not row[i].endswith('W'):
+            row[i] = str(int(row[i]) + offset)
+    return row
+
+def _contdir_row(row, offset):
+    row = _offset(row, [1, 3], offset)
+    row[0] = str(int(row[1]) * 1000 + int(row[3]))
+    return row
+
+def _ksgp4(name, scale):
+    lines = pkgutil.get_data("irdata", "data/%s" % name).splitlines()
+    out = [lines[0]]
+    for k in range(scale):
+        for line in lines[1:]:
+            ccode, rest = line.split(' ', 1)
+            out.append('%d %s' % (int(ccode) + k * OFFSET, rest))
+    return '\n'.join(out) + '\n'
+
+def _warlist(scale):
+    lines = pkgutil.get_data("irdata", "data/WarList_NEW.txt").splitlines(True)
+    out = []
+    for k in range(scale):
+        for line in lines:
+            out.append(re.sub(r'#(\d+)',
+                              lambda m: '#%d' % (int(m.group(1)) + k * OFFSET),
+                              line))
+    return ''.join(out)
+
+def write_packaged(dirname, scale):
+    """ Copies of the MID, contiguity, KSG Polity and war list files """
+    files = {'MIDA_3.10.csv': _copies('MIDA_3.10.csv', scale, _mida_row),
+             'MIDB_3.10.csv': _copies('MIDB_3.10.csv', scale,
+                                      lambda row, x: _offset(row, [0], x)),
+             'DirectContiguity310/contdir.csv':
+                 _copies('DirectContiguity310/contdir.csv', scale, _contdir_row),
+             'ksgp4use.asc': _ksgp4('ksgp4use.asc', scale),
+             'ksgp4duse.asc': _ksgp4('ksgp4duse.asc', scale),
+             'WarList_NEW.txt': _warlist(scale)}
+    for name, data in files.iteritems():
+        with open(_makedirs(path.join(dirname, 'data', name)), 'wb') as f:
+            f.write(data)
+
+def packaged(dirname, name):
+    """ Path of the copy of packaged file name """
+    return path.join(dirname, 'data', name)
+
+def generate(dirname, scale=1, seed=0):
+    """ Write all synthetic inputs
+
+    :param dirname: output directory
+    :param scale: multiple of the size of the original data
+    :param seed: seed of the random states and values
+    """
+    rand = random.Random(seed)
+    cow = states(STATES * scale, rand)
+    write_cow_states(dirname, cow)
+    write_ksg_states(dirname, states(KSG_STATES * scale, rand),
+                     states(KSG_MICROSTATES * scale, rand,
+                            first=KSG_STATES * scale + 1))
+    write_nmc(dirname, cow, rand)
+    if xlwt is not None:
+        write_polity(dirname, cow, rand)
+    write_packaged(dirname, scale)
@@ -0,0 +1,151 @@
+""" Time the loaders against synthetic inputs
+
+::
+
+  $ python -m benchmarks.run -s 1 -s 10 sqlite:///bench.db postgresql://localhost/bench
+
+For each scale the inputs are written by :mod:`benchmarks.inputs`,
+and each case is run in a new process against empty tables created
+without indexes, CHECK or foreign key constraints (see
+:func:`irdata.load.schema.bare_metadata`), since the synthetic rows of
+one loader do not reference those of the others. Rows per second
+count the rows written by INSERT or COPY, and memory is the peak
+resident memory of the process, both as recorded by
+:mod:`irdata.load.profiling`.
+
+Polity is only benchmarked if xlwt is installed.
+
+"""
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+from os import path
+
+import sqlalchemy as sa
+
+from irdata import model
+from irdata.load import (cow_states, ksg_states, nmc, polity, mid,
+                         contdir, ksg_polity, war4, schema, profiling)
+from benchmarks import inputs
+
+SCALES = [1, 10, 100]
+""" Default scales """
+
+def _open(dirname, name):
+    return open(inputs.packaged(dirname, name), 'rb')
+
+def bench_mid(dirname):
+    mid.load_mida(_open(dirname, 'MIDA_3.10.csv'))
+    mid.load_midb(_open(dirname, 'MIDB_3.10.csv'))
+
+def bench_contdir(dirname):
+    contdir.load_contdir(_open(dirname, 'DirectContiguity310/contdir.csv'))
+
+def bench_ksg_polity(dirname):
+    ksg_polity.load_ksgp4duse(_open(dirname, 'ksgp4duse.asc'))
+    ksg_polity.load_ksgp4use(_open(dirname, 'ksgp4use.asc'))
+
+def bench_war4_list(dirname):
+    war4.load_war4_list(_open(dirname, 'WarList_NEW.txt'))
+
+CASES = [('cow_states', cow_states.load_all),
+         ('ksg_states', ksg_states.load_all),
+         ('nmc', nmc.load_all),
+         ('polity', polity.load_all),
+         ('mid', bench_mid),
+         ('contdir', bench_contdir),
+         ('ksg_polity', bench_ksg_polity),
+         ('war4_list', bench_war4_list)]
+""" Benchmark cases, as pairs of a name and a function of the input directory """
+
+def run_case(url, name, dirname):
+    """ Run one case against empty tables
+
+    :param url: database url
+    :param name: name of a case in :data:`CASES`
+    :param dirname: directory written by :func:`benchmarks.inputs.generate`
+    :return: dict of the measurements of :class:`irdata.load.profiling.Stage`
+    """
+    engine = sa.create_engine(url)
+    model.Base.metadata.bind = engine
+    bare = schema.bare_metadata()
+    bare.drop_all(engine)
+    bare.create_all(engine)
+    profiler = profiling.Profiler(loaders=[])
+    try:
+        with profiler:
+            with profiler.stage(name) as stage:
+                dict(CASES)[name](dirname)
+    finally:
+        engine.dispose()
+    return stage.as_dict()
+
+def _run_in_process(*args):
+    ## A new process for each case, so that peak memory is its own
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_case, args)
+    finally:
+        pool.close()
+        pool.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the irdata loaders')
+    parser.add_argument('-s', '--scale', metavar='N', dest='scales',
+                        action='append', type=int, default=None,
+                        help='multiple of the size of the original data. '
+                        'Can be repeated. Default: %s' %
+                        ', '.join(str(x) for x in SCALES))
+    parser.add_argument('-c', '--case', metavar='CASE', dest='cases',
+                        action='append', default=None,
+                        choices=[x[0] for x in CASES],
+                        help='case to run. Can be repeated. Default: all')
+    parser.add_argument('-d', '--dir', metavar='DIR', dest='dirname',
+                        default=None,
+                        help='keep the generated inputs in DIR')
+    parser.add_argument('--json', metavar='PATH', dest='json', default=None,
+                        help='write the results as JSON to PATH')
+    parser.add_argument('engines', metavar='ENGINE', nargs='*',
+                        help='database urls. Default: a temporary SQLite file')
+    opts = parser.parse_args()
+
+    cases = opts.cases or [x[0] for x in CASES]
+    if inputs.xlwt is None and 'polity' in cases:
+        print("Skipping polity: xlwt is not installed")
+        cases.remove('polity')
+    tempdir = tempfile.mkdtemp()
+    workdir = opts.dirname or tempdir
+    engines = opts.engines or ['sqlite:///%s' % path.join(tempdir, 'bench.db')]
+    results = []
+    fmt = "%6s %-12s %-12s %9s %10s %10s %9s"
+    try:
+        for scale in opts.scales or SCALES:
+            dirname = path.join(workdir, 'x%d' % scale)
+            print("Writing inputs at scale %d to %s" % (scale, dirname))
+            inputs.generate(dirname, scale)
+            print(fmt % ('scale', 'engine', 'case', 'seconds', 'rows',
+                         'rows/s', 'peak MB'))
+            for url in engines:
+                for name in cases:
+                    x = _run_in_process(url, name, dirname)
+                    x['scale'] = scale
+                    x['engine'] = sa.engine.url.make_url(url).drivername
+                    x['rows_per_second'] = (x['rows_written'] / x['seconds']
+                                            if x['seconds'] else None)
+                    results.append(x)
+                    print(fmt % (scale, x['engine'], name,
+                                 '%.2f' % x['seconds'], x['rows_written'],
+                                 '%.0f' % (x['rows_per_second'] or 0),
+                                 '%.1f' % (x['peak_rss'] / 1024.)))
+                    sys.stdout.flush()
+    finally:
+        shutil.rmtree(tempdir)
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+""" Content-addressed cache of external data sources
+
+Files are stored once under ``<root>/objects`` by their SHA-256
+digest. The index ``<root>/index.yaml`` maps each source url to the
+digest of its content and the headers of its last download (see
+:func:`irdata.download.fetch`).
+
+A cache can be used instead of a download directory, both by
+:func:`irdata.download.download_all` and by the loaders, which find
+their inputs with :func:`resolve`. Using an object updates its
+modification time, and :meth:`Cache.evict` removes the least recently
+used objects once the cache is larger than a given size.
+
+The index is written atomically, but concurrent writers of the same
+cache may lose each other's entries. Objects are never modified.
+
+"""
+import os
+import errno
+import hashlib
+import shutil
+from os import path
+
+import yaml
+
+INDEX = 'index.yaml'
+
+def _makedirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _local_path(url):
+    ## Avoid a circular import
+    from irdata import download
+    return download.local_path(url, '')
+
+
+class Cache(object):
+    """ Content-addressed cache of downloaded files
+
+    :param root: cache directory. Created if it does not exist.
+
+    """
+    def __init__(self, root):
+        self.root = root
+        self._index = None
+        self._names = None
+
+    def __repr__(self):
+        return 'Cache(%r)' % self.root
+
+    @property
+    def index(self):
+        """ dict mapping urls to dicts with keys ``sha256``, ``size``, etc. """
+        if self._index is None:
+            try:
+                with open(path.join(self.root, INDEX)) as f:
+                    self._index = yaml.safe_load(f) or {}
+            except IOError:
+                self._index = {}
+        return self._index
+
+    def save(self):
+        """ Write the index """
+        _makedirs(self.root)
+        filename = path.join(self.root, INDEX)
+        with open(filename + '.tmp', 'w') as f:
+            yaml.safe_dump(self.index, f, default_flow_style=False)
+        os.rename(filename + '.tmp', filename)
+        self._names = None
+
+    def object_path(self, digest):
+        """ Path of the object with SHA-256 digest ``digest`` """
+        return path.join(self.root, 'objects', digest[:2], digest[2:])
+
+    def get(self, url):
+        """ Path of the cached content of a url
+
+        :raises KeyError: if the url is not in the cache.
+        """
+        digest = self.index.get(url, {}).get('sha256')
+        if digest is None:
+            raise KeyError(url)
+        filename = self.object_path(digest)
+        try:
+            os.utime(filename, None)
+        except OSError:
+            raise KeyError(url)
+        return filename
+
+    def lookup(self, name):
+        """ Path of the cached content of a source
+
+        :param name: path of the source relative to a download
+          directory, e.g. ``"www.systemicpeace.org/inscr/p4v2010.xls"``.
+          See :func:`irdata.download.local_path`.
+        :raises KeyError: if the source is not in the cache.
+        """
+        if self._names is None:
+            self._names = dict((_local_path(url), url) for url in self.index)
+        return self.get(self._names[path.normpath(name)])
+
+    def add(self, url, filename, digest=None, **meta):
+        """ Move a file into the cache as the content of a url
+
+        :param url: source url
+        :param filename: file to move. It is removed.
+        :param digest: SHA-256 digest of the file, if known
+        :param meta: other values to keep in the index entry of the url
+        :return: path of the object
+
+        """
+        if digest is None:
+            from irdata import download
+            digest = download.sha256sum(filename)
+        dst = self.object_path(digest)
+        size = path.getsize(filename)
+        if path.exists(dst):
+            os.remove(filename)
+            os.utime(dst, None)
+        else:
+            _makedirs(path.dirname(dst))
+            shutil.move(filename, dst)
+        entry = dict(meta)
+        entry.update({'sha256': digest, 'size': size})
+        self.index[url] = entry
+        self.save()
+        return dst
+
+    def size(self):
+        """ Total size of the objects in bytes """
+        return sum(size for filename, size, mtime in self._objects())
+
+    def _objects(self):
+        objects = path.join(self.root, 'objects')
+        if not path.isdir(objects):
+            return
+        for prefix in os.listdir(objects):
+            for x in os.listdir(path.join(objects, prefix)):
+                filename = path.join(objects, prefix, x)
+                st = os.stat(filename)
+                yield filename, st.st_size, st.st_mtime
+
+    def evict(self, max_size):
+        """ Remove least recently used objects
+
+        :param max_size: maximum total size of the objects in bytes
+        :return: list of urls whose content was removed
+
+        """
+        objects = sorted(self._objects(), key=lambda x: x[2], reverse=True)
+        total = 0
+        removed = set()
+        for filename, size, mtime in objects:
+            total += size
+            if total > max_size:
+                os.remove(filename)
+                removed.add(filename)
+        urls = [url for url, entry in self.index.items()
+                if entry.get('sha256') and
+                self.object_path(entry['sha256']) in removed]
+        for url in urls:
+            del self.index[url]
+        if urls:
+            self.save()
+        return urls
+
+    def staging_path(self, url):
+        """ Path in which to download a url before it is added """
+        name = hashlib.sha1(url).hexdigest()
+        return path.join(self.root, 'tmp', name)
+
+
+def resolve(external, name):
+    """ Path of an external data source
+
+    :param external: download directory, or :class:`Cache`
+    :param name: path of the source relative to the download directory
+    """
+    if isinstance(external, Cache):
+        return external.lookup(name)
+    return path.join(external, name)
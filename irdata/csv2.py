@@ -7,6 +7,12 @@ All code taken from http://docs.python.org/library/csv.html
 import csv
 import codecs
 import cStringIO
+import itertools
+import collections
+import multiprocessing
+
+CHUNK_SIZE = 1 << 20
+""" Approximate number of bytes in each chunk parsed by :class:`ChunkedReader` """
 
 def unicode_csv_reader(unicode_csv_data, dialect=csv.excel, **kwargs):
     # csv.py doesn't do Unicode; encode temporarily as UTF-8:
@@ -70,6 +76,246 @@ class DictReader(Reader):
         return dict(zip(self.fieldnames, row))
 
 
+def _universal_lines(f, size=65536):
+    """ Iterate over the lines of a byte stream
+
+    Lines can end in \\n, \\r\\n, or \\r, and the line endings are kept.
+    """
+    tail = ''
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            break
+        lines = (tail + chunk).splitlines(True)
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+def _ascii_compatible(encoding):
+    """ Whether the CSV delimiters are encoded as single ASCII bytes """
+    chars = u',;|"\' \t\r\n'
+    try:
+        return chars.encode(encoding) == chars.encode('ascii')
+    except UnicodeError:
+        return False
+
+
+class Row(object):
+    """ A row of a :class:`TupleReader`
+
+    Values can be accessed by column index or column name.
+    :meth:`TupleReader.rows` reuses the same object for every row,
+    so copy any values that need to outlive the next row.
+    """
+    __slots__ = ('values', 'fieldnames', '_index')
+
+    def __init__(self, fieldnames, values=()):
+        self.fieldnames = fieldnames
+        self._index = dict((k, i) for i, k in enumerate(fieldnames))
+        self._index.update((i, i) for i in range(len(fieldnames)))
+        self.values = values
+
+    def __getitem__(self, k):
+        return self.values[self._index[k]]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def asdict(self):
+        return dict(zip(self.fieldnames, self.values))
+
+
+class TupleReader(object):
+    """
+    A CSV reader which yields each row as a tuple.
+
+    Unlike :class:`Reader`, each cell is decoded exactly once. For
+    encodings in which the delimiters are ASCII (e.g. utf-8, latin-1)
+    the csv module parses the raw bytes directly. Cells matching an
+    entry in na are replaced by None; all other cells are decoded
+    and passed to the converter of their column, if any.
+
+    :param f: file-like object with a read method
+    :param fieldnames: column names. If omitted, the first row is used.
+    :param converters: dict mapping column names or indexes to
+      functions applied to the decoded cell
+    :param encoding: encoding of f
+    :param na: strings which denote missing values
+
+    Assigning to :attr:`fieldnames` renames the columns; converters
+    keyed by name refer to the current names.
+    """
+
+    def __init__(self, f, fieldnames=None, converters=None,
+                 dialect=csv.excel, encoding="utf-8", na=[''], **kwds):
+        if _ascii_compatible(encoding):
+            lines = _universal_lines(f)
+            self._encoding = encoding
+        else:
+            lines = UTF8Recoder(f, encoding)
+            self._encoding = 'utf-8'
+        self.reader = csv.reader(lines, dialect=dialect, **kwds)
+        self._na = frozenset(x.encode(self._encoding)
+                             if isinstance(x, unicode) else x for x in na)
+        self.converters = converters or {}
+        if fieldnames:
+            self.fieldnames = fieldnames
+        else:
+            self.fieldnames = [unicode(x, self._encoding)
+                               for x in self.reader.next()]
+
+    @property
+    def fieldnames(self):
+        return self._fieldnames
+
+    @fieldnames.setter
+    def fieldnames(self, value):
+        self._fieldnames = list(value)
+        self._cells = []
+        for i, k in enumerate(self._fieldnames):
+            conv = self.converters.get(k, self.converters.get(i))
+            self._cells.append(self._cell(conv))
+
+    def _cell(self, conv):
+        """ Function converting a raw cell of a column """
+        na = self._na
+        encoding = self._encoding
+        if conv is None:
+            def cell(x, unicode=unicode):
+                return None if x in na else unicode(x, encoding)
+        else:
+            def cell(x, unicode=unicode):
+                return None if x in na else conv(unicode(x, encoding))
+        return cell
+
+    def next(self):
+        row = self.reader.next()
+        values = tuple([f(x) for f, x in zip(self._cells, row)])
+        if len(values) < len(self._cells):
+            values += (None, ) * (len(self._cells) - len(values))
+        return values
+
+    def __iter__(self):
+        return self
+
+    def index(self, name):
+        """ Position of the column name """
+        return self._fieldnames.index(name)
+
+    def rows(self):
+        """ Iterate over rows as a single, reused :class:`Row` """
+        row = Row(self._fieldnames)
+        for values in self:
+            row.values = values
+            yield row
+
+
+def _parse_chunk(data, kwds):
+    """ Parse a chunk of lines into a tuple of columns """
+    return zip(*TupleReader(cStringIO.StringIO(data), **kwds))
+
+
+class ChunkedReader(object):
+    """
+    A CSV reader which parses the file in a pool of processes.
+
+    The file is read in chunks of about ``chunk_size`` bytes, each
+    extended to the end of its last line, and each chunk is parsed by
+    a :class:`TupleReader` in a worker process, which returns its
+    columns. Rows are yielded in the order of the file, as tuples, and
+    at most two chunks per process are read ahead.
+
+    Records cannot span lines, and the encoding must be ASCII
+    compatible. Converters are sent to the worker processes, so they
+    must be picklable, e.g. module-level functions. Inside a daemonic
+    process, such as a worker of :func:`irdata.load.schedule.run`,
+    which cannot start processes, chunks are parsed serially.
+
+    :param f: file-like object with read and readline methods
+    :param processes: number of worker processes. Defaults to the
+      number of CPUs.
+    :param chunk_size: bytes per chunk
+    :param **kwds: passed to :class:`TupleReader`
+
+    Assigning to :attr:`fieldnames` renames the columns, as in
+    :class:`TupleReader`.
+    """
+
+    def __init__(self, f, fieldnames=None, converters=None, encoding="utf-8",
+                 processes=None, chunk_size=CHUNK_SIZE, **kwds):
+        if not _ascii_compatible(encoding):
+            raise ValueError("cannot split %s encoded files into chunks" %
+                             encoding)
+        self._f = f
+        self._kwds = dict(kwds, encoding=encoding)
+        self.converters = converters or {}
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        if fieldnames:
+            self.fieldnames = list(fieldnames)
+        else:
+            header = cStringIO.StringIO(f.readline())
+            self.fieldnames = TupleReader(header, **self._kwds).fieldnames
+        self._rows = None
+
+    def _chunks(self):
+        while True:
+            data = self._f.read(self.chunk_size)
+            if not data:
+                break
+            yield data + self._f.readline()
+
+    def _columns(self):
+        """ Columns of each chunk, in order """
+        kwds = dict(self._kwds, fieldnames=self.fieldnames,
+                    converters=self.converters)
+        if self.processes == 1 or multiprocessing.current_process().daemon:
+            for data in self._chunks():
+                yield _parse_chunk(data, kwds)
+            return
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            pending = collections.deque()
+            for data in self._chunks():
+                pending.append(pool.apply_async(_parse_chunk, (data, kwds)))
+                if len(pending) >= 2 * self.processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            ## Also stops the workers if the reader is abandoned
+            pool.terminate()
+            pool.join()
+
+    def _generate(self):
+        for columns in self._columns():
+            for row in itertools.izip(*columns):
+                yield row
+
+    def next(self):
+        if self._rows is None:
+            self._rows = self._generate()
+        return self._rows.next()
+
+    def __iter__(self):
+        return self
+
+    def index(self, name):
+        """ Position of the column name """
+        return self.fieldnames.index(name)
+
+
 class Writer(object):
     """
     A CSV writer which will write rows to CSV file 
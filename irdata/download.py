@@ -1,45 +1,423 @@
-""" Download external sources needed to build the database """
+""" Download external sources needed to build the database
+
+Files are downloaded by a pool of worker threads. Each worker keeps
+one persistent HTTP connection per host. Files are saved under the
+download directory in the same layout as ``wget -x``,
+i.e. ``<dirname>/<host>/<path>``.
+
+The ETag and Last-Modified headers of each download are kept in the
+file ``.irdata-download.yaml`` in the download directory, and are
+used to make conditional requests, so that unchanged files are not
+downloaded again. Data is written to ``<file>.part`` until the
+download is complete; an interrupted download is resumed with a
+``Range`` request if the server supports it.
+
+Files can instead be downloaded into a content-addressed cache, see
+:mod:`irdata.cache`. The headers are then kept in the cache index.
+
+Entries of ``filelist.yaml`` are either urls or dicts with keys
+``url`` and, optionally, ``sha256``. Downloads are checked against
+the SHA-256 checksum when one is given.
+
+"""
 import sys
-import os 
+import os
 from os import path
 import argparse
-import subprocess as sp
+import email.utils
+import hashlib
+import shutil
+import httplib
+import Queue
+import socket
+import threading
+import time
+import urllib
+import urlparse
 
 import yaml
 
-def wget(filename, dirname):
-    """ wget wrapper
+from irdata import cache
+
+JOBS = 4
+""" Default number of concurrent downloads """
+
+TIMEOUT = 60
+""" Socket timeout in seconds """
+
+MAX_REDIRECTS = 5
+
+CHUNK_SIZE = 1 << 16
+
+STATE_FILE = '.irdata-download.yaml'
+""" File in the download directory with the headers of previous downloads """
+
+USER_AGENT = 'irdata'
+
+FILELIST = path.join(path.dirname(__file__), 'data', 'filelist.yaml')
 
-    :param filename: str. file to download
-    :param dirname: str. directory in which to download the file.
+def read_filelist(filename=FILELIST):
+    """ Read a list of files to download
+
+    :param filename: yaml file with a list of urls, or of dicts with
+      keys ``url`` and ``sha256``.
+    :rtype: list of ``(url, sha256)`` tuples. ``sha256`` is None if
+      no checksum is given.
 
-    Runs `wget -xN -P [dirname] [filename]`.
-    
     """
-    sp.call(["wget", "-x", "-N", "-P", dirname, filename])
-    
+    with open(filename) as f:
+        entries = yaml.load(f)
+    out = []
+    for x in entries:
+        if isinstance(x, dict):
+            out.append((x['url'], x.get('sha256')))
+        else:
+            out.append((x, None))
+    return out
+
+def local_path(url, dirname):
+    """ Path to which a url is downloaded, as in ``wget -x`` """
+    parts = urlparse.urlsplit(url)
+    pth = urllib.unquote(parts.path).lstrip('/').split('/')
+    return path.join(dirname, parts.netloc, *pth)
+
+def sha256sum(filename):
+    """ Hex SHA-256 digest of a file """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Connections(object):
+    """ Persistent HTTP connections, one per host
+
+    Not thread safe; each worker thread has its own.
+    """
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self._conns = {}
+
+    def request(self, url, headers):
+        """ GET url
+
+        A request on a reused connection which the server has closed
+        is retried once on a new connection.
+
+        :rtype: :class:`httplib.HTTPResponse`
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        selector = urlparse.urlunsplit(('', '', parts.path or '/',
+                                        parts.query, ''))
+        for retry in (True, False):
+            conn = self._conns.get(key)
+            reused = conn is not None
+            if not reused:
+                if parts.scheme == 'https':
+                    kls = httplib.HTTPSConnection
+                elif parts.scheme == 'http':
+                    kls = httplib.HTTPConnection
+                else:
+                    raise ValueError("unsupported url: %s" % url)
+                conn = self._conns[key] = kls(parts.netloc,
+                                              timeout=self.timeout)
+            try:
+                conn.request('GET', selector, headers=headers)
+                return conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                del self._conns[key]
+                if not (retry and reused):
+                    raise
+
+    def close(self):
+        for conn in self._conns.values():
+            conn.close()
+        self._conns.clear()
 
-def download_all(dirname):
+
+def _discard(resp):
+    """ Read the rest of a response so that the connection can be reused """
+    while resp.read(CHUNK_SIZE):
+        pass
+
+def _set_mtime(filename, last_modified):
+    try:
+        mtime = email.utils.mktime_tz(email.utils.parsedate_tz(last_modified))
+    except (TypeError, ValueError):
+        return
+    os.utime(filename, (time.time(), mtime))
+
+def fetch(url, filename, state, connections, sha256=None, checkpoint=None):
+    """ Download a url unless the local copy is up to date
+
+    :param url: url to download
+    :param filename: path to save it to
+    :param state: dict with the ``etag`` and ``last_modified``
+      headers of the previous download of the url. It is updated
+      with those of this download.
+    :param connections: :class:`Connections`
+    :param sha256: expected SHA-256 checksum, or None.
+    :param checkpoint: function called with state once the response
+      headers are read, before the body is written to the partial
+      file, so that an interrupted download can be resumed.
+    :return: True if the file was downloaded, False if it was not
+      modified.
+
+    """
+    part = filename + '.part'
+    dirname = path.dirname(filename)
+    if not path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            ## created by another worker
+            if not path.isdir(dirname):
+                raise
+    src = url
+    redirects = 0
+    while True:
+        headers = {'User-Agent': USER_AGENT}
+        offset = path.getsize(part) if path.exists(part) else 0
+        partial = state.get('partial')
+        if offset and partial:
+            headers['Range'] = 'bytes=%d-' % offset
+            headers['If-Range'] = partial
+        elif path.exists(filename):
+            if state.get('etag'):
+                headers['If-None-Match'] = state['etag']
+            headers['If-Modified-Since'] = (state.get('last_modified') or
+                                            email.utils.formatdate(path.getmtime(filename),
+                                                                   usegmt=True))
+        resp = connections.request(src, headers)
+        if resp.status in (301, 302, 303, 307, 308):
+            _discard(resp)
+            redirects += 1
+            if redirects > MAX_REDIRECTS:
+                raise IOError("too many redirects")
+            src = urlparse.urljoin(src, resp.getheader('location'))
+            continue
+        if resp.status == 304:
+            _discard(resp)
+            return False
+        if resp.status == 416:
+            ## the partial file does not match what the server has
+            _discard(resp)
+            os.remove(part)
+            del state['partial']
+            continue
+        if resp.status == 206:
+            content_range = resp.getheader('content-range', '')
+            if not content_range.startswith('bytes %d-' % offset):
+                _discard(resp)
+                raise IOError("unexpected Content-Range %r" % content_range)
+            mode = 'ab'
+        elif resp.status == 200:
+            mode = 'wb'
+        else:
+            _discard(resp)
+            raise IOError("HTTP %d %s" % (resp.status, resp.reason))
+        break
+    etag = resp.getheader('etag')
+    last_modified = resp.getheader('last-modified')
+    ## Weak ETags cannot be used in If-Range
+    if etag and not etag.startswith('W/'):
+        state['partial'] = etag
+    elif last_modified:
+        state['partial'] = last_modified
+    else:
+        state.pop('partial', None)
+    if checkpoint is not None:
+        checkpoint(state)
+    with open(part, mode) as f:
+        for chunk in iter(lambda: resp.read(CHUNK_SIZE), ''):
+            f.write(chunk)
+    length = resp.getheader('content-length')
+    if mode == 'ab' and length is not None:
+        length = int(length) + offset
+    if length is not None and path.getsize(part) != int(length):
+        raise IOError("incomplete download")
+    digest = sha256sum(part)
+    if sha256 and digest != sha256.lower():
+        os.remove(part)
+        state.pop('partial', None)
+        raise IOError("SHA-256 checksum %s does not match %s" %
+                      (digest, sha256))
+    os.rename(part, filename)
+    if last_modified:
+        _set_mtime(filename, last_modified)
+    state.pop('partial', None)
+    state['etag'] = etag
+    state['last_modified'] = last_modified
+    state['sha256'] = digest
+    return True
+
+class _Directory(object):
+    """ Downloads in a directory laid out as with ``wget -x`` """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        try:
+            with open(path.join(dirname, STATE_FILE)) as f:
+                self.state = yaml.safe_load(f) or {}
+        except IOError:
+            self.state = {}
+
+    def target(self, url):
+        return local_path(url, self.dirname), dict(self.state.get(url, {}))
+
+    def checkpoint(self, url, state):
+        self.commit(url, None, state, None)
+
+    def commit(self, url, filename, state, downloaded):
+        self.state[url] = dict(state)
+        filename = path.join(self.dirname, STATE_FILE)
+        with open(filename + '.tmp', 'w') as f:
+            yaml.safe_dump(self.state, f, default_flow_style=False)
+        os.rename(filename + '.tmp', filename)
+
+
+class _Cache(object):
+    """ Downloads in a :class:`irdata.cache.Cache`
+
+    A url is downloaded to a staging file, which is a link to its
+    cached content, if any, so that conditional requests can be made.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+
+    def target(self, url):
+        filename = self.cache.staging_path(url)
+        if path.exists(filename):
+            os.remove(filename)
+        state = dict(self.cache.index.get(url, {}))
+        state.pop('size', None)
+        try:
+            src = self.cache.get(url)
+        except KeyError:
+            return filename, state
+        cache._makedirs(path.dirname(filename))
+        try:
+            os.link(src, filename)
+        except (AttributeError, OSError):
+            shutil.copy2(src, filename)
+        return filename, state
+
+    def checkpoint(self, url, state):
+        ## the cached content, if any, is still valid
+        entry = dict(self.cache.index.get(url, {}))
+        entry.pop('partial', None)
+        if state.get('partial'):
+            entry['partial'] = state['partial']
+        self.cache.index[url] = entry
+        self.cache.save()
+
+    def commit(self, url, filename, state, downloaded):
+        if downloaded:
+            self.cache.add(url, filename, state.pop('sha256'), **state)
+            return
+        if path.exists(filename):
+            os.remove(filename)
+        if state.get('sha256'):
+            self.cache.index[url].update(state)
+        else:
+            ## keep the headers of a partial download
+            self.cache.index[url] = state
+        self.cache.save()
+
+def download_all(dirname, jobs=JOBS, filelist=FILELIST):
     """ Download all external data sources
 
-    :param dir: directory to download to (optional)
-    :rtype: none
+    :param dirname: directory to download to, or a
+      :class:`irdata.cache.Cache`
+    :param jobs: number of concurrent downloads
+    :param filelist: yaml file with the files to download.
+      See :func:`read_filelist`.
+    :return: list of urls which were downloaded, i.e. not up to date.
 
     """
-    if dir:
+    if isinstance(dirname, cache.Cache):
+        store = _Cache(dirname)
+    else:
         if not os.path.isdir(dirname):
             print("creating %s" % dirname)
             os.makedirs(dirname)
-    with open(path.join(path.dirname(__file__),
-                        'data', 'filelist.yaml')) as f:
-        filelist = yaml.load(f)
-    for fname in filelist:
-        wget(fname, dirname)
- 
+        store = _Directory(dirname)
+    lock = threading.Lock()
+    todo = Queue.Queue()
+    for x in read_filelist(filelist):
+        todo.put(x)
+    downloaded = []
+    errors = []
+
+    def worker():
+        connections = Connections()
+        try:
+            while True:
+                try:
+                    url, sha256 = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                with lock:
+                    filename, st = store.target(url)
+                def checkpoint(st, url=url):
+                    with lock:
+                        store.checkpoint(url, st)
+                try:
+                    ok = fetch(url, filename, st, connections, sha256,
+                               checkpoint)
+                except Exception as e:
+                    ok = None
+                    with lock:
+                        errors.append((url, e))
+                with lock:
+                    store.commit(url, filename, st, ok)
+                    if ok:
+                        downloaded.append(url)
+                    if ok is not None:
+                        print("%s %s" % ("downloaded" if ok else "up to date", url))
+        finally:
+            connections.close()
+
+    threads = [threading.Thread(target=worker)
+               for i in range(max(1, min(jobs, todo.qsize())))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    ## join without a timeout cannot be interrupted by Ctrl-C
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(1)
+    if errors:
+        raise RuntimeError("failed to download:\n%s" %
+                           '\n'.join("%s: %s" % x for x in errors))
+    return downloaded
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Download external data for irdata ')
+    parser.add_argument('-j', '--jobs', metavar="N", default=JOBS,
+                        dest='jobs',
+                        type=int, help='number of concurrent downloads')
+    parser.add_argument('-f', '--filelist', metavar="FILE", default=FILELIST,
+                        dest='filelist',
+                        type=str, help='yaml file with urls to download')
+    parser.add_argument('-C', '--cache', default=False, action='store_true',
+                        dest='cache',
+                        help='download into a content-addressed cache')
+    parser.add_argument('--max-size', metavar="MB", default=None,
+                        dest='max_size', type=int,
+                        help='evict least recently used files from the cache '
+                        'once it is larger than this')
     parser.add_argument('directory', metavar='dir',
                         type=str, help='directory in which to download data sources.')
     opts = parser.parse_args()
     print(opts)
-    download_all(opts.directory)
+    if opts.cache:
+        dst = cache.Cache(opts.directory)
+    else:
+        dst = opts.directory
+    download_all(dst, jobs=opts.jobs, filelist=opts.filelist)
+    if opts.cache and opts.max_size is not None:
+        for url in dst.evict(opts.max_size << 20):
+            print("evicted %s" % url)
@@ -1,34 +1,49 @@
 """ Load all data into the irdata database  """
 from os import path
 import argparse
+import cProfile
 import tempfile
 import shutil
 import sys
 
 import sqlalchemy as sa
 
+from irdata import cache
 from irdata import model
 from irdata import download
+from irdata import resources
+from irdata import xls
 from irdata.load import (version, cow_states, ksg_states,
                          nmc, polity, war4, war3,
                          contdir, ksg_polity, ksg_to_cow,
-                         mid)
+                         mid, utils, schedule, incremental, artifact,
+                         schema, profiling, swap)
 
-def load_all(EXTERNAL):
-    """ Load data into the database """
+def load_all(EXTERNAL, jobs=1, changed_only=False, deferred=False):
+    """ Load data into the database
+
+    :param jobs: number of loaders to run in parallel.
+      See :func:`irdata.load.schedule.run`.
+    :param changed_only: only rerun loaders whose inputs have changed
+      since the last build. See :func:`irdata.load.incremental.run`.
+    :param deferred: create indexes, CHECK and foreign key constraints
+      after loading the data. See :mod:`irdata.load.schema`.
+    """
+    if changed_only:
+        loaders = incremental.run(EXTERNAL, jobs=jobs)
+        print("Reloaded: %s" % (', '.join(loaders) or 'nothing'))
+        return
     ## Load data from cow system
     model.Base.metadata.drop_all(checkfirst=True)
-    model.Base.metadata.create_all(checkfirst=True)
-    version.load_all(EXTERNAL)
-    cow_states.load_all(EXTERNAL)
-    ksg_states.load_all(EXTERNAL)
-    ksg_to_cow.load_all(EXTERNAL)
-    nmc.load_all(EXTERNAL)
-    polity.load_all(EXTERNAL)
-    war4.load_all(EXTERNAL)
-    war3.load_all(EXTERNAL)
-    contdir.load_all(EXTERNAL)
-    ksg_polity.load_all(EXTERNAL)
+    if deferred:
+        schema.create_tables()
+    else:
+        model.Base.metadata.create_all(checkfirst=True)
+    schedule.run(EXTERNAL, jobs=jobs)
+    if deferred:
+        schema.add_deferred()
+    incremental.record(dict((x, incremental.digest(x, EXTERNAL))
+                            for x in schedule.LOADERS))
 
 def load_one(loader, EXTERNAL):
     foo = sys.modules['irdata.load.%s' % loader]
@@ -51,33 +66,151 @@ def main():
     parser.add_argument('-D', '--dst', metavar='dest', dest="dest",
                         default=None, required=False,
                         type=str, help='directory in which to download data sources.')
+    parser.add_argument('-C', '--cache', metavar='dir', dest="cache",
+                        default=None, required=False, type=str,
+                        help='content-addressed cache of data sources. '
+                        'See irdata.cache.')
     parser.add_argument('-L', '--loader', metavar="LOADER", default=None,
                         dest='loader',
                         type=str, help='load')
-    parser.add_argument('engine', metavar="ENGINE", default=None, 
+    parser.add_argument('-B', '--batch-size', metavar="N", default=None,
+                        dest='batch_size',
+                        type=int, help='number of rows per INSERT statement')
+    parser.add_argument('-j', '--jobs', metavar="N", default=1,
+                        dest='jobs',
+                        type=int, help='number of loaders to run in parallel')
+    parser.add_argument('-I', '--incremental', default=False,
+                        action='store_true', dest='incremental',
+                        help='only reload data whose inputs have changed')
+    parser.add_argument('--defer-constraints', default=False,
+                        action='store_true', dest='deferred',
+                        help='add indexes and constraints after loading the data')
+    parser.add_argument('--sql-derived', default=False, action='store_true',
+                        dest='sql_derived',
+                        help='create derived panel tables inside the database')
+    parser.add_argument('--no-copy', default=True, action='store_false',
+                        dest='copy',
+                        help='use INSERT instead of COPY on PostgreSQL')
+    parser.add_argument('-P', '--parse-processes', metavar="N", default=1,
+                        dest='parse_processes', type=int,
+                        help='number of processes parsing large delimited files')
+    parser.add_argument('--max-pending-rows', metavar="N", default=None,
+                        dest='max_rows', type=int,
+                        help='write rows to the database whenever N are held '
+                        'in memory, and print the peak memory of each loader')
+    parser.add_argument('--max-pending-mb', metavar="MB", default=None,
+                        dest='max_mb', type=float,
+                        help='write rows to the database whenever they take '
+                        'about MB megabytes, and print the peak memory of '
+                        'each loader')
+    parser.add_argument('--pipeline', default=False, action='store_true',
+                        dest='pipeline',
+                        help='write to the database in a background thread while parsing')
+    parser.add_argument('--no-xls-cache', default=True, action='store_false',
+                        dest='xls_cache',
+                        help='always parse xls workbooks. See irdata.xls')
+    parser.add_argument('--atomic', default=False, action='store_true',
+                        dest='atomic',
+                        help='build into a staging schema or file, and swap it '
+                        'in once complete. On PostgreSQL, views and foreign '
+                        'keys on the previous tables must be recreated. '
+                        'See irdata.load.swap')
+    parser.add_argument('--sqlite-artifact', metavar="PATH", default=None,
+                        dest='artifact', type=str,
+                        help='build into a new SQLite file instead of ENGINE')
+    parser.add_argument('--profile', default=False, action='store_true',
+                        dest='profile',
+                        help='print the time, rows and memory of each loader stage')
+    parser.add_argument('--profile-output', metavar="PATH", default=None,
+                        dest='profile_output', type=str,
+                        help='write cProfile statistics to PATH. Implies --profile')
+    parser.add_argument('--profile-json', metavar="PATH", default=None,
+                        dest='profile_json', type=str,
+                        help='write the stage metrics as JSON to PATH. '
+                        'Implies --profile')
+    parser.add_argument('engine', metavar="ENGINE", default=None, nargs='?',
                         type=str, help='database engine')
 
     opts = parser.parse_args()
-    if opts.dest:
+    if not (opts.engine or opts.artifact):
+        parser.error("either ENGINE or --sqlite-artifact is required")
+    if opts.atomic and (opts.artifact or not opts.engine):
+        parser.error("--atomic requires ENGINE, and not --sqlite-artifact")
+    if opts.atomic and (opts.loader or opts.incremental):
+        parser.error("--atomic always builds every loader")
+    if opts.cache:
+        EXTERNAL = cache.Cache(opts.cache)
+        xls.CACHE_DIR = path.join(opts.cache, 'xls')
+        tempdir = False
+    elif opts.dest:
         EXTERNAL = opts.dest
         tempdir = False
     else:
         EXTERNAL = tempfile.mkdtemp()
         tempdir = True
     kwargs = {}
+    if opts.batch_size:
+        utils.BATCH_SIZE = opts.batch_size
+        utils.COPY_BATCH_SIZE = opts.batch_size
+    utils.USE_COPY = opts.copy
+    utils.DERIVE_IN_DATABASE = opts.sql_derived
+    xls.SIDECAR = opts.xls_cache
+    utils.PIPELINE = opts.pipeline
+    utils.PARSE_PROCESSES = opts.parse_processes
+    utils.MAX_PENDING_ROWS = opts.max_rows
+    if opts.max_mb:
+        utils.MAX_PENDING_BYTES = int(opts.max_mb * 1024 * 1024)
+    profile = opts.profile or opts.profile_output or opts.profile_json
+    if profile and opts.jobs > 1:
+        print("Profiling: loaders are run serially")
+        opts.jobs = 1
+    profiler = profiling.Profiler()
+    stats = cProfile.Profile() if opts.profile_output else None
 
     try:
         #download.download_all(EXTERNAL)
-        # reload database
-        model.Base.metadata.bind = sa.create_engine(opts.engine, **kwargs)
-        print("Loading data into %s" % opts.engine)
-        if opts.loader:
-            load_one(opts.loader, EXTERNAL)
-        else:
-            load_all(EXTERNAL)
+        if profile:
+            profiler.install()
+        if stats:
+            stats.enable()
+        with profiler.stage('total'):
+            if opts.artifact:
+                print("Building %s" % opts.artifact)
+                artifact.build(opts.artifact, EXTERNAL)
+                return
+            if opts.atomic:
+                print("Building %s" % opts.engine)
+                kept = swap.build(opts.engine, EXTERNAL, jobs=opts.jobs)
+                if kept:
+                    print("Other objects depend on the previous tables, "
+                          "which were kept in schema %s" % kept)
+                return
+            # reload database
+            model.Base.metadata.bind = sa.create_engine(opts.engine, **kwargs)
+            print("Loading data into %s" % opts.engine)
+            if opts.loader:
+                load_one(opts.loader, EXTERNAL)
+            else:
+                load_all(EXTERNAL, jobs=opts.jobs,
+                         changed_only=opts.incremental,
+                         deferred=opts.deferred)
     except Exception:
         raise
     finally:
+        if stats:
+            stats.disable()
+            stats.dump_stats(opts.profile_output)
+        if profile:
+            profiler.uninstall()
+            profiler.report()
+        if opts.profile_json:
+            profiler.write_json(opts.profile_json)
+        if (opts.max_rows or opts.max_mb) and schedule.PEAK_RSS:
+            print("%-20s %9s" % ('loader', 'peak MB'))
+            for name in schedule.LOADERS:
+                if name in schedule.PEAK_RSS:
+                    print("%-20s %9.1f" % (name, schedule.PEAK_RSS[name] / 1024.))
+        resources.clear()
         # cleanup temporary directory-+
         if tempdir:
             shutil.rmtree(EXTERNAL)
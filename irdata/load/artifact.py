@@ -0,0 +1,92 @@
+""" Build the database as a single-file SQLite artifact
+
+The build writes to a fresh file with no rollback journal and no
+syncs, inside one transaction. Indexes are created once the data is
+loaded, and the file is analyzed and vacuumed at the end. It is
+written to ``<filename>.tmp`` and renamed when complete, so a failed
+build never leaves a partial artifact.
+
+"""
+import os
+import sqlite3
+
+import sqlalchemy as sa
+from sqlalchemy import pool
+
+from irdata import model
+from irdata.load import schedule
+from irdata.load import incremental
+from irdata.load import schema
+
+class _Connection(object):
+    """ DBAPI connection whose commits and rollbacks are ignored
+
+    The build is run in one transaction on a single connection shared
+    by all loaders, which would otherwise commit after each loader.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def build(filename, external, check=None, prepare=None):
+    """ Build the database into a new SQLite file
+
+    :param filename: path of the SQLite file. It is replaced if it exists.
+    :param external: directory with external data sources, or
+      :class:`irdata.cache.Cache`
+    :param check: function called with an engine of the new file before
+      it replaces filename. If it raises, the build is discarded.
+    :param prepare: function called with an engine of the new file
+      once the loaders have run, before the indexes are created, e.g.
+      to copy other tables into it. No transaction is open.
+
+    """
+    tmp = filename + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    ## isolation_level=None: sqlite3 does not begin or commit
+    ## transactions by itself
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    proxy = _Connection(conn)
+    engine = sa.create_engine('sqlite://', creator=lambda: proxy,
+                              poolclass=pool.StaticPool)
+    metadata = model.Base.metadata
+    bind = metadata.bind
+    metadata.bind = engine
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        schema.create_tables(engine, defer=('index', ))
+        conn.execute("BEGIN")
+        schedule.run(external, jobs=1)
+        incremental.record(dict((x, incremental.digest(x, external))
+                                for x in schedule.LOADERS))
+        conn.execute("COMMIT")
+        if prepare is not None:
+            prepare(engine)
+        schema.add_deferred(engine, defer=('index', ))
+        conn.execute("ANALYZE")
+        conn.execute("VACUUM")
+        if check is not None:
+            check(engine)
+    except:
+        conn.close()
+        os.remove(tmp)
+        raise
+    finally:
+        metadata.bind = bind
+        engine.dispose()
+    conn.close()
+    os.rename(tmp, filename)
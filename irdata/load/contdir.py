@@ -14,9 +14,12 @@ from irdata.load import utils
 KLS = [model.ContType,
        model.ContDir]
 
+DATA = ["contiguity_type.yaml", "DirectContiguity310/contdir.csv"]
+""" Files in irdata/data read by load_all """
+
 def load_contdir(src):
     """ Load direct contiguity data from csv file"""
-    session = model.SESSION()
+    loader = utils.BulkLoader()
     reader = csv2.DictReader(src, encoding='latin1')
     cols = [x.name for x in model.ContDir.__table__.c]
     for row in reader:
@@ -33,8 +36,8 @@ def load_contdir(src):
         row['end_date'] = end_mon
         row['start_date'] = start_mon
         data = utils.subset(row, cols)
-        session.add(model.ContDir(**data))
-    session.commit()
+        loader.add(model.ContDir, data)
+    loader.close()
 
 def unload():
     for x in reversed(KLS):
@@ -42,5 +45,6 @@ def unload():
 
 def load_all(external):
     """ Load all direct contiguity data """
-    utils.load_enum_from_yaml(utils.get_data("contiguity_type.yaml"))
-    load_contdir(utils.get_data("DirectContiguity310/contdir.csv"))
+    enums, contdir = DATA
+    utils.load_enum_from_yaml(utils.get_data(enums))
+    load_contdir(utils.get_data(contdir))
@@ -1,25 +1,29 @@
 """ Loading COW Interstate System Data """
 from os import path
 import collections
-import datetime
 import zipfile
 import re
-import calendar
 
 import sqlalchemy as sa
 import yaml
 
 from irdata import csv2
+from irdata import cache
 from irdata import model
 from irdata.load import utils
 
+SOURCES = ["www.correlatesofwar.org/COW2 Data/SystemMembership/2008/states2008.1.csv",
+           "www.correlatesofwar.org/COW2 Data/SystemMembership/2008/majors2008.1.csv"]
+""" Files in the external data directory read by load_all """
+
 KLS = [model.CowState,
        model.CowSysMembership,
-       model.CowMajor]
+       model.CowMajor,
+       model.CowSystem]
 
 def load_cow_states(src):
     """ Load data into cow_statelist and cow_system_membership """
-    session = model.SESSION()
+    loader = utils.BulkLoader()
     reader = csv2.DictReader(src)
     reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
     cnt = collections.Counter()
@@ -27,20 +31,20 @@ def load_cow_states(src):
         ccode = row['ccode']
         cnt[row['ccode']] +=1
         if cnt[ccode] == 1:
-            session.add(model.CowState(ccode = ccode,
-                                       state_abb = row['state_abb'],
-                                       state_nme = row['state_nme']))
+            loader.add(model.CowState, {'ccode': ccode,
+                                        'state_abb': row['state_abb'],
+                                        'state_nme': row['state_nme']})
         st_date = utils.row_ymd(row, 'st_year', 'st_month', 'st_day')
         end_date = utils.row_ymd(row, 'end_year', 'end_month', 'end_day')
-        session.add(model.CowSysMembership(ccode = ccode,
-                                           interval = cnt[ccode],
-                                           st_date = st_date,
-                                           end_date = end_date))
-    session.commit()
+        loader.add(model.CowSysMembership, {'ccode': ccode,
+                                            'interval': cnt[ccode],
+                                            'st_date': st_date,
+                                            'end_date': end_date})
+    loader.close()
 
 def load_cow_majors(src):
     """ Load data into cow_majors """
-    session = model.SESSION()
+    loader = utils.BulkLoader()
     reader = csv2.DictReader(src)
     reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
     cnt = collections.Counter()
@@ -49,33 +53,29 @@ def load_cow_majors(src):
         cnt[row['ccode']] +=1
         st_date = utils.row_ymd(row, 'st_year', 'st_month', 'st_day')
         end_date = utils.row_ymd(row, 'end_year', 'end_month', 'end_day')
-        session.add(model.CowMajor(ccode = ccode,
-                                    interval = cnt[ccode],
-                                    st_date = st_date,
-                                    end_date = end_date))
-    session.commit()
+        loader.add(model.CowMajor, {'ccode': ccode,
+                                    'interval': cnt[ccode],
+                                    'st_date': st_date,
+                                    'end_date': end_date})
+    loader.close()
 
 def load_cow_system():
     """ load data into cow_system """ 
-    session = model.SESSION()
-    for st in session.query(model.CowSysMembership):
-        for yr in range(st.st_date.year, st.end_date.year + 1):
-            eoy = datetime.date(yr, 12, 31)
-            boy = datetime.date(yr, 1, 1)
-            moy = datetime.date(yr, 7, 2)
-            start_year = (st.st_date <= boy and st.end_date >= boy)
-            mid_year = (st.st_date <= moy and st.end_date >= moy)
-            end_year = (st.st_date <= eoy and st.end_date >= eoy)
-            ndays = 366 if calendar.isleap(yr) else 365
-            frac_year = (min(eoy, st.end_date) - max(boy, st.st_date)).days / float(ndays)
-            session.add(model.CowSystem(ccode = st.ccode,
-                                        year = yr,
-                                        start_year = start_year,
-                                        mid_year = mid_year,
-                                        end_year = end_year,
-                                        frac_year = frac_year))
-        session.flush()
-    session.commit()
+    loader = utils.BulkLoader()
+    q = model.CowSysMembership.__table__.select()
+    spells = loader.connection.execute(q).fetchall()
+    for spell, row in utils.spell_years(spells, 'st_date', 'end_date',
+                                        mid=(7, 2)):
+        row['ccode'] = spell.ccode
+        loader.add(model.CowSystem, row)
+    loader.close()
+
+def load_cow_system_sql():
+    """ load data into cow_system with INSERT ... SELECT """
+    utils.insert_spell_years(model.CowSysMembership.__table__,
+                             model.CowSystem.__table__,
+                             {'ccode': 'ccode'}, 'st_date', 'end_date',
+                             mid=(7, 2))
 
 def unload():
     for x in reversed(KLS):
@@ -83,8 +83,12 @@ def unload():
 
 def load_all(external):
     """ Load all COW System data """
-    load_cow_states(open(path.join(external, "www.correlatesofwar.org/COW2 Data/SystemMembership/2008/states2008.1.csv"), 'rb'))
-    load_cow_majors(open(path.join(external, "www.correlatesofwar.org/COW2 Data/SystemMembership/2008/majors2008.1.csv"), 'rb'))
-    load_cow_system()
+    states, majors = [cache.resolve(external, x) for x in SOURCES]
+    load_cow_states(open(states, 'rb'))
+    load_cow_majors(open(majors, 'rb'))
+    if utils.DERIVE_IN_DATABASE:
+        load_cow_system_sql()
+    else:
+        load_cow_system()
     
 
@@ -0,0 +1,160 @@
+""" Rebuild only the loaders whose inputs have changed
+
+The inputs of a loader are the source of its module, the database
+model, the shared code in :data:`SHARED`, the files in ``irdata/data`` listed in the ``DATA`` attribute
+of its module, and the files in the external data directory listed in
+its ``SOURCES`` attribute. The SHA-1 digest of the inputs of each
+loader is stored in table ``build_state`` after it is run.
+
+"""
+import datetime
+import hashlib
+import inspect
+from os import path
+
+from irdata import cache
+from irdata import csv2
+from irdata import model
+from irdata import resources
+from irdata import xls
+from irdata.load import schedule
+from irdata.load import utils
+
+SHARED = [model, utils, csv2, xls, resources]
+""" Modules used by all loaders. A change to any of them reruns every loader """
+
+def _update_file(h, filename, size=1 << 20):
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                break
+            h.update(chunk)
+
+def digest(name, external):
+    """ SHA-1 digest of the inputs of a loader
+
+    :param external: download directory, or :class:`irdata.cache.Cache`
+
+    A missing external file is hashed as empty, so the loader is
+    rerun (and fails) once it is needed.
+    """
+    mod = schedule.loader_module(name)
+    h = hashlib.sha1()
+    for m in SHARED + [mod]:
+        h.update(inspect.getsource(m))
+    for x in getattr(mod, 'DATA', []):
+        h.update(x)
+        h.update(resources.data(x))
+    for x in getattr(mod, 'SOURCES', []):
+        h.update(x)
+        try:
+            filename = cache.resolve(external, x)
+        except KeyError:
+            continue
+        if path.exists(filename):
+            _update_file(h, filename)
+    return unicode(h.hexdigest())
+
+def previous_digests():
+    """ Digests stored by the last build, keyed by loader """
+    tbl = model.BuildState.__table__
+    if not tbl.exists():
+        return {}
+    return dict((row.loader, row.digest) for row in tbl.select().execute())
+
+def stale(external, loaders=schedule.LOADERS):
+    """ Loaders that need to be rerun
+
+    A loader is stale if its digest differs from the one recorded in
+    the last build, or if any loader it depends on is stale.
+
+    :rtype: tuple of the list of stale loaders, in the order in which
+      they are run, and a dict of digests of all loaders
+    """
+    deps = schedule.dependencies(loaders)
+    old = previous_digests()
+    new = dict((x, digest(x, external)) for x in loaders)
+    out = set()
+    for name in schedule.toposort(deps, loaders):
+        if old.get(name) != new[name] or deps[name] & out:
+            out.add(name)
+    return [x for x in loaders if x in out], new
+
+def record(digests):
+    """ Store loader digests in table build_state """
+    tbl = model.BuildState.__table__
+    tbl.create(checkfirst=True)
+    conn = model.Base.metadata.bind.connect()
+    trans = conn.begin()
+    try:
+        conn.execute(tbl.delete().where(tbl.c.loader.in_(digests.keys())))
+        now = datetime.datetime.now()
+        conn.execute(tbl.insert(), [{'loader': k, 'digest': v, 'loaded_at': now}
+                                    for k, v in digests.iteritems()])
+        trans.commit()
+    except Exception:
+        trans.rollback()
+        raise
+    finally:
+        conn.close()
+
+def run(external, jobs=1, loaders=schedule.LOADERS):
+    """ Rerun stale loaders
+
+    The tables of the stale loaders, and any tables outside of
+    ``loaders`` referencing them, are dropped and recreated, so
+    changes to their definitions in the model are picked up. The
+    stale loaders are then run with :func:`irdata.load.schedule.run`.
+    Their digests are only recorded after all of them have succeeded.
+
+    The loaders of the other dropped tables which held rows, for
+    example those of :data:`irdata.load.schedule.OPTIONAL`, are rerun
+    after them, with all of their tables emptied first.
+
+    :raises ValueError: if a dropped table holding rows is not loaded
+      by any loader. Nothing is dropped.
+
+    :param external: directory with external data sources
+    :param jobs: number of loaders to run at the same time
+    :param loaders: list of loader names
+    :return: list of loaders that were run
+
+    """
+    todo, digests = stale(external, loaders)
+    if not todo:
+        return todo
+    metadata = model.Base.metadata
+    tbl = model.BuildState.__table__
+    tbl.create(checkfirst=True)
+    tables = set(t for x in todo for t in schedule.loader_tables(x))
+    ## Tables of other loaders (e.g. mid) referencing a dropped table
+    others = set()
+    for t in metadata.sorted_tables:
+        if (t not in tables and
+            any(fk.column.table in tables for fk in t.foreign_keys)):
+            tables.add(t)
+            others.add(t)
+    owner = {}
+    for name in schedule.LOADERS + schedule.OPTIONAL:
+        for t in schedule.loader_tables(name):
+            owner[t] = name
+    rerun = set()
+    for t in others:
+        if t.exists() and t.select().limit(1).execute().first() is not None:
+            if t not in owner:
+                raise ValueError("table %s references reloaded tables but "
+                                 "has no loader; rebuild the database" % t.name)
+            rerun.add(owner[t])
+    tbl.delete().where(tbl.c.loader.in_(todo)).execute()
+    metadata.drop_all(tables=list(tables), checkfirst=True)
+    metadata.create_all(checkfirst=True)
+    schedule.run(external, jobs=jobs, loaders=todo)
+    record(dict((x, digests[x]) for x in todo))
+    for name in schedule.LOADERS + schedule.OPTIONAL:
+        if name in rerun:
+            mod = schedule.loader_module(name)
+            for kls in reversed(mod.KLS):
+                kls.__table__.delete().execute()
+            mod.load_all(external)
+    return todo + sorted(rerun)
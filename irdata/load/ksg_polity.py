@@ -8,7 +8,6 @@ from os import path
 import sqlalchemy as sa
 import yaml
 
-from irdata import csv2
 from irdata import model
 from irdata.load import utils
 
@@ -17,6 +16,9 @@ KLS = [model.KsgP4dOrigin,
        model.KsgP4duse,
        model.KsgP4use]
 
+DATA = ["ksgp4_enum.yaml", "ksgp4duse.asc", "ksgp4use.asc"]
+""" Files in irdata/data read by load_all """
+
 
 def _strpftime(x):
     """ Strpftime that works before 1900"""
@@ -25,38 +27,35 @@ def _strpftime(x):
 
 def load_ksgp4duse(src):
     """ Load data for table ksgp4duse """
-    session = model.SESSION()
-    reader = csv2.DictReader(src, delimiter = ' ')
+    loader = utils.BulkLoader()
+    reader = utils.tuple_reader(src, delimiter = ' ', na = ['', '.'],
+                                converters = {'startdate': _strpftime,
+                                              'enddate': _strpftime})
     reader.fieldnames = [x.lower() for x in reader.fieldnames]
     cols = [x.name for x in model.KsgP4duse.__table__.c]
+    keep = [(i, k) for i, k in enumerate(reader.fieldnames) if k in cols]
     for row in reader:
-        row['startdate'] = _strpftime(row['startdate'])
-        row['enddate'] = _strpftime(row['enddate'])
-        for k, v in row.iteritems():
-            if v == '.':
-                row[k] = None
-        session.add(model.KsgP4duse(**utils.subset(row, cols)))
-    session.commit()    
+        loader.add(model.KsgP4duse, dict((k, row[i]) for i, k in keep))
+    loader.close()
 
 def load_ksgp4use(src):
     """ Load data for table ksgp4use """ 
-    session = model.SESSION()
-    reader = csv2.DictReader(src, delimiter = ' ')
+    loader = utils.BulkLoader()
+    reader = utils.tuple_reader(src, delimiter = ' ', na = ['', '.'])
     reader.fieldnames = [x.lower() for x in reader.fieldnames]
     cols = [x.name for x in model.KsgP4use.__table__.c]
+    keep = [(i, k) for i, k in enumerate(reader.fieldnames) if k in cols]
     for row in reader:
-        for k, v in row.iteritems():
-            if v == '.':
-                row[k] = None
-        session.add(model.KsgP4use(**utils.subset(row, cols)))
-    session.commit()
+        loader.add(model.KsgP4use, dict((k, row[i]) for i, k in keep))
+    loader.close()
 
 def unload():
     for x in KLS:
         x.__table__.delete().execute()
 
 def load_all(external):
-    utils.load_enum_from_yaml(utils.get_data("ksgp4_enum.yaml"))
-    load_ksgp4duse(utils.get_data("ksgp4duse.asc"))
-    load_ksgp4use(utils.get_data("ksgp4use.asc"))    
+    enums, p4duse, p4use = DATA
+    utils.load_enum_from_yaml(utils.get_data(enums))
+    load_ksgp4duse(utils.get_data(p4duse))
+    load_ksgp4use(utils.get_data(p4use))    
     
@@ -9,10 +9,15 @@ import sqlalchemy as sa
 import yaml
 
 from irdata import csv2
+from irdata import cache
 from irdata import model
 from irdata.load import utils
 
-KLS = [model.KsgState, model.KsgSysMembership]
+KLS = [model.KsgState, model.KsgSysMembership, model.KsgSystem]
+
+SOURCES = ["privatewww.essex.ac.uk/~ksg/data/iisystem.dat",
+           "privatewww.essex.ac.uk/~ksg/data/microstatessystem.dat"]
+""" Files in the external data directory read by load_all """
 
 def _iisystem_dates(x):
     """ Parse iisystem dates
@@ -26,7 +31,7 @@ def _iisystem_dates(x):
 
 def _load_ksg_states(src, microstate):
     """ Create ksg_states """
-    session = model.SESSION()
+    loader = utils.BulkLoader()
     HEADER = ['idnum', 'idabb', 'country_name', 'start_date', 'end_date']
     rowgen = csv2.DictReader(src, delimiter='\t',
                              fieldnames = HEADER, encoding='latin-1')
@@ -35,18 +40,18 @@ def _load_ksg_states(src, microstate):
         idnum = row["idnum"]
         cnt[idnum] += 1
         if cnt[idnum] == 1:
-            session.add(model.KsgState(idnum = idnum,
-                                       idabb = row["idabb"],
-                                       country_name = row["country_name"],
-                                       microstate = microstate))
+            loader.add(model.KsgState, {'idnum': idnum,
+                                        'idabb': row["idabb"],
+                                        'country_name': row["country_name"],
+                                        'microstate': microstate})
         interval = cnt[idnum]
         start_date = _iisystem_dates(row['start_date'])
         end_date = _iisystem_dates(row['end_date'])
-        session.add(model.KsgSysMembership(ccode = idnum,
-                                           start_date = start_date,
-                                           end_date = end_date,
-                                           interval = interval))
-    session.commit()
+        loader.add(model.KsgSysMembership, {'ccode': idnum,
+                                            'start_date': start_date,
+                                            'end_date': end_date,
+                                            'interval': interval})
+    loader.close()
 
 def load_ksg_states(src1, src2):
     for x in ((src1, False), (src2, True)):
@@ -54,13 +59,20 @@ def load_ksg_states(src1, src2):
 
 def load_ksg_system():
     """ Create cow_system table """ 
-    session = model.SESSION()
-    for st in session.query(model.KsgSysMembership):
-        for yr in range(st.start_date.year, st.end_date.year + 1):
-            session.add(model.KsgSystem(ccode = st.ccode,
-                                        year = yr))
-        session.flush()
-    session.commit()
+    loader = utils.BulkLoader()
+    q = model.KsgSysMembership.__table__.select()
+    spells = loader.connection.execute(q).fetchall()
+    for spell, row in utils.spell_years(spells, 'start_date', 'end_date'):
+        loader.add(model.KsgSystem, {'ccode': spell.ccode,
+                                     'year': row['year']})
+    loader.close()
+
+def load_ksg_system_sql():
+    """ Create ksg_system table with INSERT ... SELECT """
+    utils.insert_spell_years(model.KsgSysMembership.__table__,
+                             model.KsgSystem.__table__,
+                             {'ccode': 'ccode'}, 'start_date', 'end_date',
+                             flags=False)
 
 def unload():
     for x in reversed(KLS):
@@ -68,8 +80,9 @@ def unload():
 
 def load_all(external):
     """ Load all KSG data """
-    load_ksg_states(open(path.join(external, "privatewww.essex.ac.uk/~ksg/data/iisystem.dat"),
-                         'rb'),
-                    open(path.join(external, "privatewww.essex.ac.uk/~ksg/data/microstatessystem.dat"),
-                         'rb'))
-    load_ksg_system()
+    states, microstates = [cache.resolve(external, x) for x in SOURCES]
+    load_ksg_states(open(states, 'rb'), open(microstates, 'rb'))
+    if utils.DERIVE_IN_DATABASE:
+        load_ksg_system_sql()
+    else:
+        load_ksg_system()
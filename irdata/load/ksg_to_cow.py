@@ -1,6 +1,5 @@
 """ Create tables linking COW to KSG """ 
 import datetime
-import calendar
 
 import sqlalchemy as sa
 from sqlalchemy import orm
@@ -8,6 +7,12 @@ from sqlalchemy import types
 from sqlalchemy.ext import declarative
 
 from irdata import model
+from irdata.load import utils
+
+KLS = [model.KsgToCow, model.KsgToCowYear]
+
+DEPENDS = ['cow_states', 'ksg_states']
+""" Loaders of the spells joined to create ksg_to_cow """
 
 ONGOING = model.CowSysMembership.ONGOING_DATE
 
@@ -37,18 +42,24 @@ def load_ksg2cow():
     - Kiribati : 946, 970
     
     """
-    session = model.SESSION()
-    q = session.query(model.CowSysMembership, model.KsgSysMembership).\
-        filter(model.CowSysMembership.ccode == model.KsgSysMembership.ccode).\
-        filter(model.CowSysMembership.st_date <= model.KsgSysMembership.end_date).\
-        filter(model.CowSysMembership.end_date >= model.KsgSysMembership.start_date)
-    for cow, ksg in q:
-        start_date = max(cow.st_date, ksg.start_date)
-        end_date = min(cow.end_date, ksg.end_date)
-        session.add(model.KsgToCow(cow_ccode = cow.ccode,
-                             ksg_ccode = ksg.ccode,
-                             start_date = start_date,
-                             end_date = end_date))
+    loader = utils.BulkLoader()
+    cow = model.CowSysMembership.__table__
+    ksg = model.KsgSysMembership.__table__
+    q = sa.select([cow.c.ccode,
+                   cow.c.st_date, cow.c.end_date,
+                   ksg.c.start_date.label('ksg_start_date'),
+                   ksg.c.end_date.label('ksg_end_date')]).\
+        where(cow.c.ccode == ksg.c.ccode).\
+        where(cow.c.st_date <= ksg.c.end_date).\
+        where(cow.c.end_date >= ksg.c.start_date)
+    data = []
+    for x in loader.connection.execute(q).fetchall():
+        start_date = max(x.st_date, x.ksg_start_date)
+        end_date = min(x.end_date, x.ksg_end_date)
+        data.append({'cow_ccode': x.ccode,
+                     'ksg_ccode': x.ccode,
+                     'start_date': start_date,
+                     'end_date': end_date})
         ## Get parts not in the data
         # if cow.st_date < ksg.start_date:
         #     session.add(model.KsgToCow(cow_ccode = cow.ccode,
@@ -71,7 +82,6 @@ def load_ksg2cow():
         #                          ksg_ccode = None,
         #                          start_date = ksg.end_date + datetime.timedelta(days=1),
         #                          end_date = cow.end_date))
-    session.flush()
 
     ## Update Germany Post 1990
     # ger = session.query(model.KsgToCow).\
@@ -79,9 +89,9 @@ def load_ksg2cow():
     #        filter(model.KsgToCow.start_date == 
     # ger.cow_ccode = 255
     #session.add(ger)
-    session.add(model.KsgToCow(ksg_ccode = 260, cow_ccode = 255,
-                               start_date = datetime.date(1990, 10, 3),
-                               end_date = ONGOING))
+    data.append({'ksg_ccode': 260, 'cow_ccode': 255,
+                 'start_date': datetime.date(1990, 10, 3),
+                 'end_date': ONGOING})
 
     # Update Yemen Post-1990
     # yemen = session.query(model.KsgToCow).\
@@ -89,18 +99,14 @@ def load_ksg2cow():
     #        filter(model.KsgToCow.start_date == datetime.date(1990, 5, 22)).one()
     # yemen.cow_ccode = 679
     # session.add(yemen)
-    session.add(model.KsgToCow(ksg_ccode = 678, cow_ccode = 679,
-                               start_date = datetime.date(1990, 5, 22),
-                               end_date = ONGOING))
-    session.flush()
+    data.append({'ksg_ccode': 678, 'cow_ccode': 679,
+                 'start_date': datetime.date(1990, 5, 22),
+                 'end_date': ONGOING})
 
     # Resolve Nauru, Tonga, Tuvalu, Kiribati
-    for x in session.query(model.KsgToCow).\
-            filter(model.KsgToCow.ksg_ccode.in_([970, 971, 972, 973])).all():
-        session.delete(x)
-    for x in session.query(model.KsgToCow).\
-            filter(model.KsgToCow.cow_ccode.in_([970, 955, 947, 946])).all():
-        session.delete(x)
+    data = [x for x in data
+            if x['ksg_ccode'] not in (970, 971, 972, 973)
+            and x['cow_ccode'] not in (970, 955, 947, 946)]
 
     NEWDATA = [ # Newdata
         # Nauru 970, 971
@@ -139,8 +145,8 @@ def load_ksg2cow():
          'ksg_ccode': 970,
          'start_date' : datetime.date(1999, 9, 14),
          'end_date' : ONGOING}]
-    for x in NEWDATA:
-        session.add(model.KsgToCow(**x))
+    data.extend(NEWDATA)
+    loader.add_all(model.KsgToCow, data)
 
     ## Any KSG without any matches
     # for ksg in session.query(model.KsgSysMembership):
@@ -163,36 +169,31 @@ def load_ksg2cow():
     #             session.add(model.KsgToCow(cow_ccode = cow.ccode,
     #                                        start_date = cow.st_date,
     #                                        end_date = cow.end_date))
-    session.commit()
+    loader.close()
 
 def load_ksg2cowyear():
     """ Load data into ksg_to_cow_year
 
     all data derived from ksg_to_cow table
     """
-    session = model.SESSION()
-    for x in session.query(model.KsgToCow):
-        start_date = x.start_date
-        end_date = x.end_date
-        yr = start_date.year
-        while yr <= end_date.year:
-            yrdays = 366 if calendar.isleap(yr) else 365
-            start_year = start_date <= datetime.date(yr, 1, 1)
-            end_year = end_date >= datetime.date(yr, 12, 31)
-            mid_year = (end_date >= datetime.date(yr, 6, 30)
-                        and start_date <= datetime.date(yr, 6, 30))
-            frac_year = ((min(datetime.date(yr, 12, 31), end_date) - 
-                          max(datetime.date(yr, 1, 1), start_date)).days + 1.0) / yrdays
-            session.add(model.KsgToCowYear(cow_ccode = x.cow_ccode,
-                                           ksg_ccode = x.ksg_ccode,
-                                           year = yr,
-                                           start_year = start_year,
-                                           end_year = end_year,
-                                           mid_year = mid_year,
-                                           frac_year = frac_year))
-            yr += 1
-        session.flush()
-    session.commit()
+    loader = utils.BulkLoader()
+    q = model.KsgToCow.__table__.select()
+    links = loader.connection.execute(q).fetchall()
+    for link, row in utils.spell_years(links, 'start_date', 'end_date',
+                                       mid=(6, 30), inclusive=True):
+        row['cow_ccode'] = link.cow_ccode
+        row['ksg_ccode'] = link.ksg_ccode
+        loader.add(model.KsgToCowYear, row)
+    loader.close()
+
+def load_ksg2cowyear_sql():
+    """ Load data into ksg_to_cow_year with INSERT ... SELECT """
+    utils.insert_spell_years(model.KsgToCow.__table__,
+                             model.KsgToCowYear.__table__,
+                             {'cow_ccode': 'cow_ccode',
+                              'ksg_ccode': 'ksg_ccode'},
+                             'start_date', 'end_date',
+                             mid=(6, 30), inclusive=True)
 
 def unload():
     for x in reversed(KLS):
@@ -202,7 +203,10 @@ def load_all(external):
     print("loading ksg_to_cow")
     load_ksg2cow()
     print("loading ksg_to_cow_year")
-    load_ksg2cowyear()
+    if utils.DERIVE_IN_DATABASE:
+        load_ksg2cowyear_sql()
+    else:
+        load_ksg2cowyear()
 
 if __name__ == '__main__':
     model.SESSION.close_all()
@@ -8,125 +8,100 @@ from os import path
 import sqlalchemy as sa
 import yaml
 
-from irdata import csv2
+from irdata import cache
 from irdata import model
 from irdata.load import utils
 
 KLS = [model.MidA, model.MidB, model.MidLinkMid, model.MidLinkWar,
        model.MidOutcome, model.MidSettle, model.MidFatality,
        model.MidHostLev, model.MidRevType, model.MidI,
-       model.MidAction]
+       model.MidIP, model.MidAction]
 
-def _int(x):
-    try:
-        y = int(re.sub(',', '', x))
-        return y if y > 0 else None
-    except TypeError:
-        return None
+_DATE_PARTS = dict((k, int) for k in ('st_year', 'st_mon', 'st_day',
+                                         'end_year', 'end_mon', 'end_day'))
 
+MIDA = utils.Coercion(model.MidA, na=('-9', ), converters=_DATE_PARTS)
+MIDB = utils.Coercion(model.MidB, na=('-9', ), converters=_DATE_PARTS)
+MIDI = utils.Coercion(model.MidI, na=('-9', ), converters=_DATE_PARTS)
+MIDIP = utils.Coercion(model.MidIP, na=('-9', ), converters=_DATE_PARTS)
+""" Conversion of the MID files; -9 is missing """
 
-def load_mida(src):
-    session = model.SESSION()
-    reader = csv2.DictReader(src, encoding='latin1')
-    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
-
-    cols = [c.name for c in model.MidA.__table__.columns]
-    int_cols = [c.name for c in model.MidA.__table__.columns
-                if isinstance(c.type, sa.types.Integer)]
-    for row in reader:
-        start_date = utils.daterng(*(_int(row[k]) for k in
-                                     ('st_year', 'st_mon', 'st_day')))
-        row['st_date_min'], row['st_date_min'] = start_date
-        end_date = utils.daterng(*(_int(row[k]) for k in
-                                   ('end_year', 'end_mon', 'end_day')))
-        row['end_date_min'], row['end_date_min'] = end_date
-        ## set -9 to NULL
-        for k in int_cols:
-            row[k] = _int(row[k])
-        session.add(model.MidA(**utils.subset(row, cols)))
-    session.commit()
+def _dates(row):
+    """ Add start and end date ranges to a row """
+    row['st_date_min'], row['st_date_max'] = \
+        utils.daterng(row['st_year'], row['st_mon'], row['st_day'])
+    row['end_date_min'], row['end_date_max'] = \
+        utils.daterng(row['end_year'], row['end_mon'], row['end_day'])
 
-def load_mid_links(src):
-    """ Load tables mid_link_mid and link_mid_war """
-    session = model.SESSION()
-    reader = csv2.DictReader(src, encoding='latin1')
-    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
-    for row in reader:
-        disp_num = row['disp_num']
-        for k in ('link%d' % i for i in range(1, 4)):
-            link = row[k]
+def _records(kls, coercion, spells=False):
+    """ Sink writing each record of a MID file to table kls
+
+    :param spells: number the records of each dispute and country in
+      column ``spell_num``.
+    """
+    def sink(fieldnames):
+        convert = coercion.compile(fieldnames)
+        cnt = collections.Counter()
+        def route(values):
+            row = convert(values)
+            if spells:
+                key = (row['disp_num'], row['ccode'])
+                cnt[key] += 1
+                row['spell_num'] = cnt[key]
+            _dates(row)
+            return ((kls, row), )
+        return route
+    return sink
+
+def _links(fieldnames):
+    """ Sink writing the links of MIDA records to mid_link_mid and mid_link_war """
+    disp_num = fieldnames.index('disp_num')
+    links = [fieldnames.index('link%d' % i) for i in range(1, 4)]
+    def route(values):
+        out = []
+        for i in links:
+            link = values[i]
             if link == '0' or link is None:
                 continue
             elif link[-1] == 'W':
-                session.add(model.MidLinkWar(disp_num = disp_num,
-                                             war_num = link[:-1]))
+                out.append((model.MidLinkWar, {'disp_num': values[disp_num],
+                                               'war_num': link[:-1]}))
             else:
-                session.add(model.MidLinkMid(disp_num_1 = disp_num,
-                                             disp_num_2 = link))
-    session.commit()
+                out.append((model.MidLinkMid, {'disp_num_1': values[disp_num],
+                                               'disp_num_2': link}))
+        return out
+    return route
+
+SINKS = {'mida': [_records(model.MidA, MIDA), _links],
+         'midb': [_records(model.MidB, MIDB, spells=True)],
+         'midi': [_records(model.MidI, MIDI)],
+         'midip': [_records(model.MidIP, MIDIP)]}
+""" Tables written from each MID file. See :func:`utils.load_csv` """
+
+def load_mid(src, name):
+    """ Load a MID file
+
+    :param src: file object
+    :param name: one of the keys of :data:`SINKS`
+    """
+    utils.load_csv(src, SINKS[name], encoding='latin1')
+
+def load_mida(src):
+    """ Load tables mid_a, mid_link_mid and mid_link_war """
+    load_mid(src, 'mida')
+
+def load_mid_links(src):
+    """ Load tables mid_link_mid and link_mid_war """
+    utils.load_csv(src, [_links], encoding='latin1')
 
 def load_midb(src):
-    session = model.SESSION()
-    reader = csv2.DictReader(src, encoding='latin1')
-    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
-    cols = [c.name for c in model.MidB.__table__.columns]
-    int_cols = [c.name for c in model.MidB.__table__.columns
-                if isinstance(c.type, sa.types.Integer)]
-    cnt = collections.Counter()
-    for row in reader:
-        cnt[(row['disp_num'], row['ccode'])] += 1
-        row['spell_num'] = cnt[(row['disp_num'], row['ccode'])]
-        start_date = utils.daterng(*(_int(row[k]) for k in
-                                     ('st_year', 'st_mon', 'st_day')))
-        row['st_date_min'], row['st_date_min'] = start_date
-        end_date = utils.daterng(*(_int(row[k]) for k in
-                                   ('end_year', 'end_mon', 'end_day')))
-        row['end_date_min'], row['end_date_min'] = end_date
-        ## set -9 to NULL
-        for k in int_cols:
-            row[k] = _int(row[k])
-        session.add(model.MidB(**utils.subset(row, cols)))
-    session.commit()
+    load_mid(src, 'midb')
 
 def load_midi(src):
-    session = model.SESSION()
-    reader = csv2.DictReader(src, encoding='latin1')
-    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
-    cols = [c.name for c in model.MidI.__table__.columns]
-    int_cols = [c.name for c in model.MidI.__table__.columns
-                if isinstance(c.type, sa.types.Integer)]
-    for row in reader:
-        start_date = utils.daterng(*(_int(row[k]) for k in
-                                     ('st_year', 'st_mon', 'st_day')))
-        row['st_date_min'], row['st_date_min'] = start_date
-        end_date = utils.daterng(*(_int(row[k]) for k in
-                                   ('end_year', 'end_mon', 'end_day')))
-        row['end_date_min'], row['end_date_min'] = end_date
-        ## set -9 to NULL
-        for k in int_cols:
-            row[k] = _int(row[k])
-        session.add(model.MidI(**utils.subset(row, cols)))
-    session.commit()
+    load_mid(src, 'midi')
 
 def load_midip(src):
-    session = model.SESSION()
-    reader = csv2.DictReader(src, encoding='latin1')
-    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
-    cols = [c.name for c in model.MidIP.__table__.columns]
-    int_cols = [c.name for c in model.MidIP.__table__.columns
-                if isinstance(c.type, sa.types.Integer)]
-    for row in reader:
-        start_date = utils.daterng(*(_int(row[k]) for k in
-                                     ('st_year', 'st_mon', 'st_day')))
-        row['st_date_min'], row['st_date_min'] = start_date
-        end_date = utils.daterng(*(_int(row[k]) for k in
-                                   ('end_year', 'end_mon', 'end_day')))
-        row['end_date_min'], row['end_date_min'] = end_date
-        ## set -9 to NULL
-        for k in int_cols:
-            row[k] = _int(row[k])
-        session.add(model.MidIP(**utils.subset(row, cols)))
-    session.commit()
+    load_mid(src, 'midip')
 
 
 def load_all(EXTERNAL):
@@ -135,7 +110,6 @@ def load_all(EXTERNAL):
     utils.load_from_yaml(utils.get_data('mid_actions.yaml'),
                          model.MidAction.__table__)
     load_mida(utils.get_data("MIDA_3.10.csv"))
-    load_mid_links(utils.get_data("MIDA_3.10.csv"))                             
     load_midb(utils.get_data("MIDB_3.10.csv"))
-    load_midi(open(path.join(EXTERNAL, cow_path, "MIDI_3.10.csv"), 'rU'))
-    load_midip(open(path.join(EXTERNAL, cow_path, "MIDIP_3.10.csv"), 'rU'))                             
+    load_midi(open(cache.resolve(EXTERNAL, path.join(cow_path, "MIDI_3.10.csv")), 'rU'))
+    load_midip(open(cache.resolve(EXTERNAL, path.join(cow_path, "MIDIP_3.10.csv")), 'rU'))                             
@@ -7,7 +7,7 @@ from os import path
 import sqlalchemy as sa
 import yaml
 
-from irdata import csv2
+from irdata import cache
 from irdata import model
 from irdata.load import utils
 
@@ -20,6 +20,12 @@ KLS = [model.NmcPecqualitycode,
        model.NmcUpopqualitycode,
        model.Nmc]
 
+DATA = ["nmc_codes.yaml"]
+""" Files in irdata/data read by load_all """
+
+SOURCES = ["www.correlatesofwar.org/COW2 Data/Capabilities/NMC_Supplement_v4_0_csv.zip"]
+""" Files in the external data directory read by load_all """
+
 def load_nmc_codes(src):
     session = model.SESSION()
     for tbl, v in yaml.load(src).iteritems():
@@ -31,36 +37,24 @@ def load_nmc_codes(src):
     session.commit()
 
 
+def _nonnegative(x):
+    v = float(x)
+    return v if v >= 0 else None
+
+NMC = utils.Coercion(model.Nmc,
+                     converters={'ccode': int,
+                                 'pec': _nonnegative,
+                                 'upopgrowth': _nonnegative,
+                                 'cinc': _nonnegative})
+""" Conversion of the NMC file; negative pec, upopgrowth, cinc are missing """
+
 def load_nmc(src):
-    def missing(x):
-        return x if x != '-9' else None
-    def _int(x):
-        try:
-            return int(x)
-        except TypeError:
-            return None
-    def _float(x):
-        try:
-            return float(x)
-        except TypeError:
-            return None
-    session = model.SESSION()
-    # session = model.SESSION()
-    reader = csv2.DictReader(src, encoding='latin-1')
-    for i, row in enumerate(reader):
-        del row['stateabb']
-        del row['statenme']
-        del row['upopanomalycode']
-        del row['version']
-        for k in ['ccode', 'irst', 'milex', 'milper', 'tpop', 'upop']:
-                row[k] = _int(row[k])
-        for k in ["pec", 'upopgrowth', 'cinc']:
-            v = _float(row[k])
-            if v < 0:
-                v = None
-            row[k]  = v
-        session.add(model.Nmc(**row))
-    session.commit()
+    loader = utils.BulkLoader()
+    reader = utils.tuple_reader(src, encoding='latin-1')
+    convert = NMC.compile(reader.fieldnames)
+    for row in reader:
+        loader.add(model.Nmc, convert(row))
+    loader.close()
 
 def unload():
     for x in reversed(KLS):
@@ -68,8 +62,7 @@ def unload():
 
 def load_all(external):
     """ Load all COW National Military Capabilities data """
-    load_nmc_codes(utils.get_data("nmc_codes.yaml"))
+    load_nmc_codes(utils.get_data(DATA[0]))
     ## If not opened with rU then throws
-    nmc_zip = zipfile.ZipFile(path.join(external,
-                                        "www.correlatesofwar.org/COW2 Data/Capabilities/NMC_Supplement_v4_0_csv.zip"))
+    nmc_zip = zipfile.ZipFile(cache.resolve(external, SOURCES[0]))
     load_nmc(nmc_zip.open('NMC_Supplement_v4_0.csv', 'rU'))
@@ -0,0 +1,121 @@
+""" Write to the database in a background thread
+
+A :class:`Writer` is the consumer stage of a producer/consumer
+pipeline: the loader parses its input and puts batches of rows into a
+bounded queue, and a thread takes them from the queue and writes them
+on its own connection, inside one transaction. Parsing and database
+round trips overlap, and when the database falls behind the queue
+fills up and the loader waits.
+
+See the ``background`` option of :class:`irdata.load.utils.BulkLoader`.
+
+"""
+import Queue
+import threading
+import traceback
+
+from sqlalchemy import pool
+from sqlalchemy.engine import Engine
+
+DEPTH = 4
+""" Default number of batches queued before the producer waits """
+
+_COMMIT = object()
+_ROLLBACK = object()
+
+def threadable(bind):
+    """ Whether a thread can open its own connection to bind
+
+    Connections are not always independent: a :class:`Connection` is
+    itself a single connection, and engines with a
+    :class:`StaticPool` or a :class:`SingletonThreadPool`, such as
+    in-memory SQLite databases, share one.
+    """
+    return (isinstance(bind, Engine) and
+            not isinstance(bind.pool, (pool.StaticPool,
+                                       pool.SingletonThreadPool)))
+
+
+class Writer(object):
+    """ Thread writing items from a bounded queue
+
+    :param bind: engine. The thread opens its own connection.
+    :param write: function called in the thread with the connection
+      and each item
+    :param depth: maximum number of items in the queue
+
+    Errors in the thread are raised, as :class:`RuntimeError`, by the
+    next :meth:`put` or by :meth:`close`. Items put after an error are
+    discarded.
+
+    """
+    def __init__(self, bind, write, depth=DEPTH):
+        self._write = write
+        self._queue = Queue.Queue(depth)
+        self._error = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(bind, ))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fail(self, conn):
+        """ Record the current exception and release the connection at once """
+        self._error = traceback.format_exc()
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _run(self, bind):
+        conn = None
+        try:
+            conn = bind.connect()
+            trans = conn.begin()
+        except Exception:
+            self._fail(conn)
+        ## Keep draining the queue after an error, so that put never
+        ## blocks forever
+        while True:
+            item = self._queue.get()
+            if item is _COMMIT or item is _ROLLBACK:
+                break
+            if self._error is None:
+                try:
+                    self._write(conn, item)
+                except Exception:
+                    self._fail(conn)
+        if self._error is None:
+            try:
+                if item is _COMMIT:
+                    trans.commit()
+                else:
+                    trans.rollback()
+            except Exception:
+                self._error = traceback.format_exc()
+            finally:
+                conn.close()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("background write failed\n%s" % self._error)
+
+    def put(self, item):
+        """ Queue an item, waiting while the queue is full """
+        self._check()
+        self._queue.put(item)
+
+    def _stop(self, message):
+        if not self._stopped:
+            self._stopped = True
+            self._queue.put(message)
+            self._thread.join()
+
+    def close(self):
+        """ Write all queued items and commit """
+        self._stop(_COMMIT)
+        self._check()
+
+    def rollback(self):
+        """ Roll back all items. Does nothing after :meth:`close` """
+        self._stop(_ROLLBACK)
@@ -9,6 +9,7 @@ import sqlalchemy as sa
 import yaml
 
 from irdata import xls
+from irdata import cache
 from irdata import model
 from irdata.load import utils
 
@@ -17,6 +18,13 @@ KLS = [model.PolityState,
        model.PolityStateYear,
        model.PolityCase]
 
+DATA = ["polity4_states.yaml"]
+""" Files in irdata/data read by load_all """
+
+SOURCES = ["www.systemicpeace.org/inscr/p4v2010.xls",
+           "www.systemicpeace.org/inscr/p4v2010d.xls"]
+""" Files in the external data directory read by load_all """
+
 def load_polity_states(src):
     POLITY_MAX_YEAR = model.PolitySysMembership.ONGOING
     session = model.SESSION()
@@ -31,7 +39,7 @@ def load_polity_states(src):
     session.commit()
 
 def load_polity_states(src):
-    session = model.SESSION()
+    loader = utils.BulkLoader()
     data = yaml.load(src)
     cnt = collections.Counter()
     cols1 = ('ccode', 'scode', 'country')
@@ -40,43 +48,52 @@ def load_polity_states(src):
         cnt[row['ccode']] += 1
         if cnt[row['ccode']] == 1:
             data1 = utils.subset(row, cols1)
-            session.add(model.PolityState(**data1))
+            loader.add(model.PolityState, data1)
         if not row['end_year']:
             row['end_year'] = model.PolitySysMembership.ONGOING
         data2 = utils.subset(row, cols2)
         data2['interval'] =  cnt[row['ccode']]
-        session.add(model.PolitySysMembership(**data2))
-    session.commit()
+        loader.add(model.PolitySysMembership, data2)
+    loader.close()
+
+POLITYD_INTEGER = ['ccode', 'present', 'persist', 'democ', 'autoc',
+                   'polity', 'xrreg', 'xrcomp', 'xropen', 'xconst',
+                   'parreg', 'parcomp', 'exrec', 'exconst', 'polcomp',
+                   'bday', 'bmonth', 'byear', 'eday', 'emonth', 'eyear']
+""" Integer columns of the Polity case file """
 
 def load_polity(src):
-    session = model.SESSION()
-    reader = xls.DictReader(src)
+    loader = utils.BulkLoader()
+    ## All columns of the state-year table are integers
+    converters = dict((c.name, int) for c in model.PolityStateYear.__table__.c)
+    reader = xls.DictReader(src, converters=converters)
     for row in reader:
         for k in ('scode', 'country'):
             del row[k]
-        session.add(model.PolityStateYear(**row))
-    session.commit()
+        loader.add(model.PolityStateYear, row)
+    loader.close()
 
 def load_polityd(src):
-    session = model.SESSION()
-    reader = xls.DictReader(src)
+    loader = utils.BulkLoader()
+    reader = xls.DictReader(src, converters=dict((x, int)
+                                                 for x in POLITYD_INTEGER))
     columns = [x.name for x in model.PolityCase.__table__.c]
     cnt = collections.Counter()
     for row in reader:
         ccode = row['ccode']
         cnt[ccode] += 1
         row['pcase'] = cnt[ccode]
-        row['present'] = row['present'] == '1'
+        row['present'] = row['present'] == 1
         for i in ('e', 'b'):
-            row['%sday' % i] = utils.replmiss(row['%sday' % i], lambda x: int(x) == 99)
-            row['%smonth' % i] = utils.replmiss(row['%smonth' % i], lambda x: int(x) == 99)
-            row['%syear' % i] = utils.replmiss(row['%syear' % i], lambda x: int(x) == 9999)
+            row['%sday' % i] = utils.replmiss(row['%sday' % i], lambda x: x == 99)
+            row['%smonth' % i] = utils.replmiss(row['%smonth' % i], lambda x: x == 99)
+            row['%syear' % i] = utils.replmiss(row['%syear' % i], lambda x: x == 9999)
         if row['byear']:
             row['bdate'] = utils.row_ymd(row, 'byear', 'bmonth', 'bday')
         if row['eyear']:
             row['edate'] = utils.row_ymd(row, 'eyear', 'emonth', 'eday')
-        session.add(model.PolityCase(**utils.subset(row, columns)))
-    session.commit()
+        loader.add(model.PolityCase, utils.subset(row, columns))
+    loader.close()
 
 def unload():
     for x in reversed(KLS):
@@ -84,7 +101,8 @@ def unload():
 
 def load_all(external):
     """ Load all Polity 4 data """
-    load_polity_states(utils.get_data("polity4_states.yaml"))
-    load_polity(path.join(external, 'www.systemicpeace.org/inscr/p4v2010.xls'))
-    load_polityd(path.join(external, 'www.systemicpeace.org/inscr/p4v2010d.xls'))
+    load_polity_states(utils.get_data(DATA[0]))
+    p4, p4d = [cache.resolve(external, x) for x in SOURCES]
+    load_polity(p4)
+    load_polityd(p4d)
 
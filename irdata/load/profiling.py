@@ -0,0 +1,218 @@
+""" Time and resource use of each loader stage
+
+While a :class:`Profiler` is installed, the ``load_all`` function of
+each loader module, and every other ``load_*`` function defined in it,
+is run as a stage, and each stage records
+
+- wall time in seconds
+- rows read by the :mod:`irdata.csv2` and :mod:`irdata.xls` readers,
+  including header lines
+- rows written by INSERT statements and PostgreSQL COPY
+- statements sent to the database (round trips)
+- peak resident memory of the process during the stage
+
+Stages nest: the counts of a ``load_*`` function are included in
+those of the ``load_all`` that called it.
+
+The peak memory of a stage is measured by resetting the peak of the
+process when the stage starts (see
+:func:`irdata.load.schedule.reset_peak_rss`). On platforms other than
+Linux it cannot be reset, and is the peak of the process so far.
+
+>>> profiler = Profiler()
+>>> with profiler:
+...     with profiler.stage('load'):
+...         schedule.run(external)
+>>> profiler.report()
+
+Only the current process is measured, so loaders should be run
+serially while profiling.
+
+"""
+import sys
+import time
+import json
+import inspect
+import functools
+import contextlib
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+
+from irdata import csv2
+from irdata import xls
+from irdata.load import schedule
+from irdata.load import utils
+from irdata.load.schedule import peak_rss, reset_peak_rss
+
+_READERS = [csv2.Reader, csv2.TupleReader, csv2.ChunkedReader, xls.Reader]
+""" Reader classes whose rows are counted """
+
+_active = None
+""" The installed :class:`Profiler` """
+
+_listening = False
+
+def _count(field, n=1):
+    if _active is not None:
+        _active.count(field, n)
+
+def _after_cursor_execute(conn, cursor, statement, parameters,
+                          context, executemany):
+    if _active is None:
+        return
+    _active.count('statements')
+    if statement.lstrip()[:6].upper() == 'INSERT':
+        n = cursor.rowcount
+        if n < 0:
+            n = len(parameters) if executemany else 1
+        _active.count('rows_written', n)
+
+def _counted_next(next):
+    def wrapper(self):
+        row = next(self)
+        _count('rows_read')
+        return row
+    return wrapper
+
+def _counted_copy(copy_rows):
+    def wrapper(conn, tbl, rows):
+        copy_rows(conn, tbl, rows)
+        _count('statements')
+        _count('rows_written', len(rows))
+    return wrapper
+
+
+class Stage(object):
+    """ Measurements of one stage
+
+    :param name: name of the stage, ``<loader>`` for ``load_all``
+      and ``<loader>.<function>`` for other functions.
+    :param depth: number of enclosing stages
+    """
+    FIELDS = ('seconds', 'rows_read', 'rows_written', 'statements',
+              'peak_rss')
+
+    def __init__(self, name, depth=0):
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.statements = 0
+        self.peak_rss = 0
+
+    def as_dict(self):
+        d = dict((x, getattr(self, x)) for x in self.FIELDS)
+        d['name'] = self.name
+        d['depth'] = self.depth
+        return d
+
+
+class Profiler(object):
+    """ Record the stages of the loaders
+
+    :param loaders: names of loader modules to instrument.
+      Defaults to all loaders run by :func:`irdata.load.schedule.run`.
+
+    Use as a context manager, or call :meth:`install` and
+    :meth:`uninstall`. Stages are kept in :attr:`stages` in the order
+    in which they started.
+
+    """
+    def __init__(self, loaders=schedule.LOADERS):
+        self.loaders = list(loaders)
+        self.stages = []
+        self._open = []
+        self._patched = []
+
+    def count(self, field, n=1):
+        """ Add n to a field of all open stages """
+        for x in self._open:
+            setattr(x, field, getattr(x, field) + n)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Run a block as a stage """
+        x = Stage(name, len(self._open))
+        ## Keep the peak of the enclosing stages before resetting it
+        rss = peak_rss()
+        for y in self._open:
+            y.peak_rss = max(y.peak_rss, rss)
+        self.stages.append(x)
+        self._open.append(x)
+        reset_peak_rss()
+        start = time.time()
+        try:
+            yield x
+        finally:
+            x.seconds = time.time() - start
+            rss = peak_rss()
+            for y in self._open:
+                y.peak_rss = max(y.peak_rss, rss)
+            self._open.pop()
+
+    def _wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _patch(self, obj, attr, value):
+        self._patched.append((obj, attr, obj.__dict__[attr]))
+        setattr(obj, attr, value)
+
+    def install(self):
+        """ Instrument the loaders, readers and database connections """
+        global _active, _listening
+        if _active is not None:
+            raise RuntimeError("a profiler is already installed")
+        for name in self.loaders:
+            mod = schedule.loader_module(name)
+            for attr, func in mod.__dict__.items():
+                if (attr.startswith('load_') and inspect.isfunction(func)
+                    and func.__module__ == mod.__name__):
+                    stage = name if attr == 'load_all' else '%s.%s' % (name, attr)
+                    self._patch(mod, attr, self._wrap(stage, func))
+        for kls in _READERS:
+            self._patch(kls, 'next', _counted_next(kls.__dict__['next']))
+        self._patch(utils, 'copy_rows', _counted_copy(utils.copy_rows))
+        ## Listeners cannot be removed in SQLAlchemy 0.7, so the
+        ## listener is added once and ignored when nothing is installed
+        if not _listening:
+            sa.event.listen(Engine, 'after_cursor_execute',
+                            _after_cursor_execute)
+            _listening = True
+        _active = self
+
+    def uninstall(self):
+        """ Restore everything patched by :meth:`install` """
+        global _active
+        while self._patched:
+            obj, attr, value = self._patched.pop()
+            setattr(obj, attr, value)
+        _active = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+    def report(self, out=sys.stdout):
+        """ Print a table of the stages """
+        fmt = "%-40s %9s %10s %12s %10s %9s\n"
+        out.write(fmt % ('stage', 'seconds', 'rows read', 'rows written',
+                         'statements', 'peak MB'))
+        for x in self.stages:
+            out.write(fmt % ('  ' * x.depth + x.name,
+                             '%.2f' % x.seconds, x.rows_read,
+                             x.rows_written, x.statements,
+                             '%.1f' % (x.peak_rss / 1024.)))
+
+    def write_json(self, filename):
+        """ Write the stages to a JSON file """
+        with open(filename, 'w') as f:
+            json.dump([x.as_dict() for x in self.stages], f, indent=2)
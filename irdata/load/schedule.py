@@ -0,0 +1,199 @@
+""" Run loaders in dependency order, optionally in parallel """
+import sys
+import Queue
+import resource
+import traceback
+import multiprocessing
+
+import sqlalchemy as sa
+
+from irdata import model
+
+LOADERS = ['version',
+           'cow_states',
+           'ksg_states',
+           'ksg_to_cow',
+           'nmc',
+           'polity',
+           'war4',
+           'war3',
+           'contdir',
+           'ksg_polity']
+""" Loaders run by load_all, in the order used when run serially """
+
+OPTIONAL = ['mid']
+""" Loaders not run by load_all, only on their own """
+
+PEAK_RSS = {}
+""" Peak resident memory in kilobytes of each loader of the last :func:`run`
+
+See :func:`reset_peak_rss` for platforms other than Linux.
+"""
+
+def reset_peak_rss():
+    """ Measure the peak resident memory from now on
+
+    Only supported on Linux, through ``/proc/self/clear_refs``.
+    Elsewhere :func:`peak_rss` stays the peak of the whole life of the
+    process.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+def peak_rss():
+    """ Peak resident memory of this process in kilobytes
+
+    The peak since the last :func:`reset_peak_rss`, where supported.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## Reported in bytes on Mac OS X
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def loader_module(name):
+    """ Module irdata.load.<name> """
+    modname = 'irdata.load.%s' % name
+    __import__(modname)
+    return sys.modules[modname]
+
+def loader_tables(name):
+    """ Tables loaded by a loader, from its KLS attribute """
+    return [kls.__table__ for kls in loader_module(name).KLS]
+
+def dependencies(loaders=LOADERS):
+    """ Loaders which must run before each loader
+
+    A loader depends on the loaders of all tables referenced by
+    foreign keys in its own tables, and on any loaders named in the
+    optional DEPENDS attribute of its module.
+
+    :param loaders: list of loader names
+    :rtype: dict mapping each loader name to a set of loader names
+
+    """
+    owner = {}
+    for name in loaders:
+        for tbl in loader_tables(name):
+            owner[tbl] = name
+    deps = {}
+    for name in loaders:
+        deps[name] = set(x for x in getattr(loader_module(name), 'DEPENDS', [])
+                         if x in loaders)
+        for tbl in loader_tables(name):
+            for fk in tbl.foreign_keys:
+                other = owner.get(fk.column.table)
+                if other and other != name:
+                    deps[name].add(other)
+    return deps
+
+def toposort(deps, loaders=LOADERS):
+    """ Order loaders so that each runs after its dependencies
+
+    Ties are broken by the order of ``loaders``.
+    """
+    order = []
+    done = set()
+    while len(order) < len(loaders):
+        ready = [x for x in loaders if x not in done and deps[x] <= done]
+        if not ready:
+            raise ValueError("circular dependencies between loaders: %s" %
+                             ', '.join(x for x in loaders if x not in done))
+        order.append(ready[0])
+        done.add(ready[0])
+    return order
+
+POLL = 1.0
+""" Seconds between checks that the worker processes are alive """
+
+def _worker_died(pool, workers):
+    """ Whether any of the worker processes of pool has exited
+
+    A pool replaces a worker which dies, and the task it was running
+    is lost. Workers are not expected to exit otherwise, so a worker
+    not in ``workers`` is a replacement.
+
+    :param workers: the workers of pool when it was started
+    """
+    return (any(p.exitcode is not None for p in workers) or
+            any(p not in workers for p in pool._pool))
+
+def _init_worker(url):
+    model.Base.metadata.bind = sa.create_engine(url)
+
+def _run_loader(name, external):
+    reset_peak_rss()
+    try:
+        loader_module(name).load_all(external)
+    except Exception:
+        return (name, traceback.format_exc(), peak_rss())
+    return (name, None, peak_rss())
+
+def run(external, jobs=1, loaders=LOADERS):
+    """ Run loaders
+
+    With ``jobs > 1`` the loaders are run in a pool of ``jobs`` worker
+    processes, each with its own engine and connections. A loader is
+    started as soon as all of its dependencies have finished.
+    SQLite only allows one writer, so it is always loaded serially.
+    If a worker process dies, :class:`RuntimeError` is raised.
+    The peak memory of each loader is stored in :data:`PEAK_RSS`.
+
+    :param external: directory with external data sources
+    :param jobs: number of loaders to run at the same time
+    :param loaders: list of loader names
+
+    """
+    deps = dependencies(loaders)
+    bind = model.Base.metadata.bind
+    PEAK_RSS.clear()
+    if jobs <= 1 or bind.dialect.name == 'sqlite':
+        for name in toposort(deps, loaders):
+            reset_peak_rss()
+            loader_module(name).load_all(external)
+            PEAK_RSS[name] = peak_rss()
+        return
+    ## Do not share pooled connections with the forked workers
+    bind.dispose()
+    pool = multiprocessing.Pool(jobs, _init_worker, (str(bind.url),))
+    results = Queue.Queue()
+    running = set()
+    finished = set()
+    workers = set(pool._pool)
+    try:
+        while len(finished) < len(loaders):
+            for name in loaders:
+                if (name not in running and name not in finished
+                    and deps[name] <= finished):
+                    running.add(name)
+                    pool.apply_async(_run_loader, (name, external),
+                                     callback=results.put)
+            while True:
+                try:
+                    name, error, PEAK_RSS[name] = results.get(timeout=POLL)
+                    break
+                except Queue.Empty:
+                    if _worker_died(pool, workers):
+                        raise RuntimeError("a worker process died while "
+                                           "running %s" %
+                                           ', '.join(sorted(running)))
+            if error:
+                raise RuntimeError("loader %s failed\n%s" % (name, error))
+            running.remove(name)
+            finished.add(name)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
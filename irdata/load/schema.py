@@ -0,0 +1,128 @@
+""" Create tables without constraints and add them after loading
+
+Bulk loads are faster into bare tables: CHECK constraints, such as
+those of :class:`irdata.model.IntegerConstrained` columns, are not
+evaluated for each inserted row, foreign keys are not checked, and
+indexes are built once instead of being updated for each row.
+
+:func:`create_tables` creates the tables with some or all of these
+deferred, and :func:`add_deferred` adds them once the data is loaded,
+validating each table in one pass. On PostgreSQL all the deferred
+constraints of a table are added with a single ALTER TABLE
+statement. SQLite cannot add constraints to an existing table, so
+each table with deferred constraints is rebuilt with its full
+definition and its rows copied into it.
+
+"""
+import sqlalchemy as sa
+
+from irdata import model
+
+DEFERRABLE = ('check', 'foreign_key', 'index')
+""" Kinds of schema objects which can be deferred """
+
+_KINDS = {'check': sa.CheckConstraint,
+          'foreign_key': sa.ForeignKeyConstraint}
+
+def _deferred_constraints(tbl, defer):
+    kinds = tuple(_KINDS[x] for x in defer if x in _KINDS)
+    return [c for c in tbl._sorted_constraints
+            if kinds and isinstance(c, kinds)]
+
+def bare_metadata(metadata=None, defer=DEFERRABLE):
+    """ Copy of metadata without deferred constraints and indexes
+
+    :param defer: kinds of objects to leave out. See :data:`DEFERRABLE`.
+    """
+    metadata = metadata if metadata is not None else model.Base.metadata
+    bare = sa.MetaData()
+    for tbl in metadata.sorted_tables:
+        copy = tbl.tometadata(bare)
+        ## The CHECK constraints of SchemaType columns are copied
+        ## twice, with the table and with the column types
+        checks = set()
+        for c in copy._sorted_constraints:
+            if isinstance(c, sa.CheckConstraint):
+                if str(c.sqltext) in checks:
+                    copy.constraints.remove(c)
+                checks.add(str(c.sqltext))
+        for c in _deferred_constraints(copy, defer):
+            copy.constraints.remove(c)
+        if 'index' in defer:
+            copy.indexes.clear()
+    return bare
+
+def create_tables(bind=None, metadata=None, defer=DEFERRABLE):
+    """ Create all tables, leaving out deferred constraints and indexes
+
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+    :param metadata: Defaults to ``model.Base.metadata``
+    :param defer: kinds of objects to leave out. See :data:`DEFERRABLE`.
+    """
+    bind = bind if bind is not None else model.Base.metadata.bind
+    bare_metadata(metadata, defer).create_all(bind=bind)
+
+def _compile(constraint, dialect):
+    compiler = dialect.ddl_compiler(dialect, None)
+    if (constraint._create_rule is not None and
+        not constraint._create_rule(compiler)):
+        return None
+    return compiler.process(constraint)
+
+def _rebuild_sqlite(conn, tbl):
+    """ Replace a bare SQLite table with one with its full definition """
+    preparer = conn.dialect.identifier_preparer
+    name = preparer.format_table(tbl)
+    bare = preparer.quote_identifier(tbl.name + '__bare')
+    cols = ', '.join(preparer.format_column(c) for c in tbl.c)
+    conn.execute("ALTER TABLE %s RENAME TO %s" % (name, bare))
+    conn.execute(sa.schema.CreateTable(tbl))
+    try:
+        conn.execute("INSERT INTO %s (%s) SELECT %s FROM %s" %
+                     (name, cols, cols, bare))
+    except:
+        ## pysqlite commits before DDL statements, so the rename is
+        ## not undone by a rollback
+        conn.execute("DROP TABLE %s" % name)
+        conn.execute("ALTER TABLE %s RENAME TO %s" % (bare, name))
+        raise
+    conn.execute("DROP TABLE %s" % bare)
+
+def add_deferred(bind=None, metadata=None, defer=DEFERRABLE):
+    """ Add the constraints and indexes left out by :func:`create_tables`
+
+    Tables are processed so that a table is always validated after
+    the tables it references. Fails, and rolls back, if any row
+    violates a constraint.
+
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+    :param metadata: Defaults to ``model.Base.metadata``
+    :param defer: kinds of objects that were left out
+    """
+    bind = bind if bind is not None else model.Base.metadata.bind
+    metadata = metadata if metadata is not None else model.Base.metadata
+    conn = bind.connect()
+    trans = conn.begin()
+    try:
+        dialect = conn.dialect
+        for tbl in metadata.sorted_tables:
+            ddl = [x for x in (_compile(c, dialect)
+                               for c in _deferred_constraints(tbl, defer))
+                   if x]
+            rebuilt = ddl and dialect.name == 'sqlite'
+            if rebuilt:
+                _rebuild_sqlite(conn, tbl)
+            elif ddl:
+                conn.execute("ALTER TABLE %s %s" %
+                             (dialect.identifier_preparer.format_table(tbl),
+                              ', '.join('ADD ' + x for x in ddl)))
+            ## Indexes are dropped with the bare table
+            if 'index' in defer or rebuilt:
+                for idx in tbl.indexes:
+                    idx.create(conn)
+        trans.commit()
+    except:
+        trans.rollback()
+        raise
+    finally:
+        conn.close()
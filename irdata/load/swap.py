@@ -0,0 +1,292 @@
+""" Build into a staging copy and swap it in atomically
+
+Readers of the live database never see missing or half-loaded
+tables, and a failed build leaves the live copy as it was.
+
+- SQLite: the database is built into ``<file>.tmp`` (see
+  :mod:`irdata.load.artifact`), which is renamed over the live file.
+  Open connections keep reading the old file.
+- PostgreSQL: the database is built in a new schema named after
+  :data:`STAGING`, by connecting with it as the only schema in the
+  search path. The tables and enum types of the model are then moved
+  into the live schema, and the old ones out of it into a new schema
+  named after :data:`OLD`, in one transaction. Other objects in the
+  live schema are left alone. The old tables are then dropped, unless
+  other objects depend on them, in which case the old schema is kept.
+
+  Views and foreign keys outside the model follow the tables they
+  reference, so after a swap they still point to the old tables and
+  must be recreated.
+
+Tables which no loader of :data:`irdata.load.schedule.LOADERS` loads,
+such as those of :data:`irdata.load.schedule.OPTIONAL`, are copied
+from the live copy into the new one (see :func:`copy_tables`). Before
+the swap the new copy is checked with :func:`validate`.
+
+"""
+import uuid
+from os import path
+
+import sqlalchemy as sa
+
+from irdata import model
+from irdata.load import artifact
+from irdata.load import incremental
+from irdata.load import schedule
+
+STAGING = 'irdata_staging'
+""" Prefix of the schema in which PostgreSQL builds are loaded """
+
+OLD = 'irdata_old'
+""" Prefix of the schema to which the previous PostgreSQL tables are moved """
+
+MIN_ROWS = 0.9
+""" Fraction of the rows of each live table which the new copy must have """
+
+def _quote(bind, name):
+    return bind.dialect.identifier_preparer.quote_identifier(name)
+
+def _qualified(bind, tbl, schema=None):
+    name = _quote(bind, tbl.name)
+    return '%s.%s' % (_quote(bind, schema), name) if schema else name
+
+def _count(bind, tbl, schema=None):
+    q = "SELECT COUNT(*) FROM %s" % _qualified(bind, tbl, schema)
+    return bind.execute(q).scalar()
+
+def _dangling(bind, fkc):
+    """ Number of rows whose foreign key references no row """
+    ## An alias, in case the table references itself
+    ref = fkc.elements[0].column.table.alias()
+    match = sa.and_(*[ref.c[fk.column.name] == fk.parent
+                      for fk in fkc.elements])
+    where = [fk.parent != None for fk in fkc.elements]
+    where.append(~sa.exists([1], match))
+    q = sa.select([sa.func.count()], sa.and_(*where), from_obj=[fkc.table])
+    return bind.execute(q).scalar()
+
+def _unowned():
+    """ Tables not loaded by any loader of :data:`schedule.LOADERS` """
+    owned = set(t for x in schedule.LOADERS for t in schedule.loader_tables(x))
+    owned.add(model.BuildState.__table__)
+    return [t for t in model.Base.metadata.sorted_tables if t not in owned]
+
+def _select_column(bind, col):
+    name = _quote(bind, col.name)
+    ## PostgreSQL enum types of the two schemas are distinct types
+    if isinstance(col.type, sa.Enum) and bind.dialect.name == 'postgresql':
+        return "CAST(CAST(%s AS TEXT) AS %s)" % (name, _quote(bind, col.type.name))
+    return name
+
+def copy_tables(bind, tables, schema):
+    """ Copy rows into tables from the tables of the same name in schema
+
+    Tables missing from schema are skipped, and only the columns in
+    both tables are copied.
+
+    :param bind: engine of the new copy
+    :param schema: schema of the live tables
+    """
+    for tbl in tables:
+        if not bind.dialect.has_table(bind, tbl.name, schema=schema):
+            continue
+        src = sa.Table(tbl.name, sa.MetaData(), schema=schema,
+                       autoload=True, autoload_with=bind)
+        cols = [c for c in tbl.c if c.name in src.c]
+        bind.execute("INSERT INTO %s (%s) SELECT %s FROM %s" %
+                     (_qualified(bind, tbl),
+                      ', '.join(_quote(bind, c.name) for c in cols),
+                      ', '.join(_select_column(bind, c) for c in cols),
+                      _qualified(bind, tbl, schema)))
+
+def validate(new, live=None, schema=None):
+    """ Check a new build before it replaces the live copy
+
+    - every foreign key references an existing row. SQLite does not
+      enforce foreign keys while the database is built.
+    - every table of the live copy has at least :data:`MIN_ROWS` of
+      its rows in the new copy.
+
+    :param new: engine of the new copy
+    :param live: engine of the live copy, or None
+    :param schema: schema of the live tables
+    :raises ValueError: if the new copy fails a check
+    """
+    errors = []
+    for tbl in model.Base.metadata.sorted_tables:
+        for fkc in tbl.constraints:
+            if isinstance(fkc, sa.ForeignKeyConstraint):
+                n = _dangling(new, fkc)
+                if n:
+                    errors.append("%s: %d rows reference missing rows of %s" %
+                                  (tbl.name, n,
+                                   fkc.elements[0].column.table.name))
+    if live is not None:
+        conn = live.connect()
+        try:
+            for tbl in model.Base.metadata.sorted_tables:
+                if not live.dialect.has_table(conn, tbl.name, schema=schema):
+                    continue
+                old = _count(conn, tbl, schema)
+                n = _count(new, tbl)
+                if n < old * MIN_ROWS:
+                    errors.append("%s: %d rows, %d in the live copy" %
+                                  (tbl.name, n, old))
+        finally:
+            conn.close()
+    if errors:
+        raise ValueError("the new build failed validation:\n%s" %
+                         '\n'.join(errors))
+
+def _enum_types(metadata):
+    return sorted(set(c.type.name for tbl in metadata.sorted_tables
+                      for c in tbl.c
+                      if isinstance(c.type, sa.Enum) and c.type.name))
+
+def _search_path(url, schema):
+    """ Copy of url connecting with schema as the only schema in the search path """
+    url = sa.engine.url.make_url(str(url))
+    url.query['options'] = '-c search_path=%s' % schema
+    return url
+
+def build_sqlite(url, external):
+    """ Build a SQLite database and replace the live file """
+    filename = sa.engine.url.make_url(url).database
+    if not filename or filename == ':memory:':
+        raise ValueError("atomic builds need a SQLite database file")
+    ## Do not create the live file by connecting to it
+    live = sa.create_engine(url) if path.exists(filename) else None
+    def prepare(engine):
+        if live is None:
+            return
+        engine.execute("ATTACH DATABASE ? AS live", (filename, ))
+        try:
+            copy_tables(engine, _unowned(), 'live')
+        finally:
+            engine.execute("DETACH DATABASE live")
+    try:
+        artifact.build(filename, external, prepare=prepare,
+                       check=lambda engine: validate(engine, live))
+    finally:
+        if live is not None:
+            live.dispose()
+
+def _new_schema(bind, prefix):
+    """ Name of a schema that does not exist yet """
+    name = '%s_%s' % (prefix, uuid.uuid4().hex[:12])
+    if bind.dialect.has_schema(bind, name):
+        raise ValueError("schema %s already exists" % name)
+    return name
+
+def _swap(conn, staging, live_schema, old_schema):
+    """ Move the tables and types of the staging schema into the live schema """
+    metadata = model.Base.metadata
+    q = lambda x: _quote(conn, x)
+    for tbl in metadata.sorted_tables:
+        if conn.dialect.has_table(conn, tbl.name, schema=live_schema):
+            conn.execute("ALTER TABLE %s SET SCHEMA %s" %
+                         (_qualified(conn, tbl, live_schema), q(old_schema)))
+        conn.execute("ALTER TABLE %s SET SCHEMA %s" %
+                     (_qualified(conn, tbl, staging), q(live_schema)))
+    for name in _enum_types(metadata):
+        if conn.dialect.has_type(conn, name, schema=live_schema):
+            conn.execute("ALTER TYPE %s.%s SET SCHEMA %s" %
+                         (q(live_schema), q(name), q(old_schema)))
+        conn.execute("ALTER TYPE %s.%s SET SCHEMA %s" %
+                     (q(staging), q(name), q(live_schema)))
+
+def _drop_old(conn, old_schema):
+    """ Drop the old schema, unless other objects depend on its contents
+
+    Everything is dropped with RESTRICT, in one transaction.
+
+    :return: whether the schema was dropped
+    """
+    metadata = model.Base.metadata
+    q = lambda x: _quote(conn, x)
+    trans = conn.begin()
+    try:
+        for tbl in reversed(metadata.sorted_tables):
+            if conn.dialect.has_table(conn, tbl.name, schema=old_schema):
+                conn.execute("DROP TABLE %s RESTRICT" %
+                             _qualified(conn, tbl, old_schema))
+        for name in _enum_types(metadata):
+            if conn.dialect.has_type(conn, name, schema=old_schema):
+                conn.execute("DROP TYPE %s.%s RESTRICT" %
+                             (q(old_schema), q(name)))
+        conn.execute("DROP SCHEMA %s RESTRICT" % q(old_schema))
+        trans.commit()
+    except sa.exc.DBAPIError:
+        trans.rollback()
+        return False
+    return True
+
+def build_postgresql(url, external, jobs=1):
+    """ Build a PostgreSQL database in a staging schema and swap it in
+
+    The live schema is the current schema of url. The previous tables
+    are dropped after the swap if nothing else depends on them.
+
+    :param jobs: number of loaders to run in parallel
+    :return: name of the schema holding the previous tables if it
+      was kept, or None
+    """
+    live = sa.create_engine(url)
+    live_schema = live.execute("SELECT current_schema()").scalar()
+    staging = _new_schema(live, STAGING)
+    old_schema = _new_schema(live, OLD)
+    live.execute("CREATE SCHEMA %s" % _quote(live, staging))
+    engine = sa.create_engine(_search_path(url, staging))
+    metadata = model.Base.metadata
+    bind = metadata.bind
+    metadata.bind = engine
+    try:
+        metadata.create_all()
+        schedule.run(external, jobs=jobs)
+        incremental.record(dict((x, incremental.digest(x, external))
+                                for x in schedule.LOADERS))
+        copy_tables(engine, _unowned(), live_schema)
+        validate(engine, live, live_schema)
+    except:
+        engine.dispose()
+        ## The staging schema was created by this build, and holds
+        ## nothing else
+        live.execute("DROP SCHEMA %s CASCADE" % _quote(live, staging))
+        raise
+    finally:
+        metadata.bind = bind
+    engine.dispose()
+    conn = live.connect()
+    trans = conn.begin()
+    try:
+        conn.execute("CREATE SCHEMA %s" % _quote(conn, old_schema))
+        _swap(conn, staging, live_schema, old_schema)
+        trans.commit()
+        conn.execute("DROP SCHEMA %s RESTRICT" % _quote(conn, staging))
+        dropped = _drop_old(conn, old_schema)
+    except:
+        if trans.is_active:
+            trans.rollback()
+        raise
+    finally:
+        conn.close()
+        live.dispose()
+    return None if dropped else old_schema
+
+def build(url, external, jobs=1):
+    """ Build the database and swap it in atomically
+
+    :param url: database url. SQLite and PostgreSQL are supported.
+    :param external: directory with external data sources, or
+      :class:`irdata.cache.Cache`
+    :param jobs: number of loaders to run in parallel, on PostgreSQL
+    :return: on PostgreSQL, the schema holding the previous tables if
+      it was kept. See :func:`build_postgresql`.
+    """
+    name = sa.engine.url.make_url(url).drivername.split('+')[0]
+    if name == 'sqlite':
+        build_sqlite(url, external)
+    elif name == 'postgresql':
+        return build_postgresql(url, external, jobs)
+    else:
+        raise ValueError("atomic builds are not supported on %s" % name)
@@ -1,10 +1,10 @@
+import sys
 import collections
 import datetime
 import zipfile
 import re
-import pkgutil
 import calendar
-from cStringIO import StringIO
+import tempfile
 
 import sqlalchemy as sa
 from sqlalchemy import types
@@ -12,7 +12,38 @@ import yaml
 
 from irdata import csv2
 from irdata import model
+from irdata import resources
+from irdata.load import pipeline
 
+BATCH_SIZE = 1000
+""" Default number of rows sent in each executemany INSERT """
+
+COPY_BATCH_SIZE = 50000
+""" Default number of rows sent in each PostgreSQL COPY """
+
+USE_COPY = True
+""" Use COPY FROM STDIN instead of INSERT on PostgreSQL """
+
+DERIVE_IN_DATABASE = False
+""" Create derived panel tables with INSERT ... SELECT in the database """
+
+COPY_SPOOL_SIZE = 8 * 1024 * 1024
+""" Bytes of COPY data held in memory before spooling to disk """
+
+PIPELINE = False
+""" Write batches of :class:`BulkLoader` in a background thread """
+
+PARSE_PROCESSES = 1
+""" Processes parsing large delimited files. See :func:`tuple_reader` """
+
+MAX_PENDING_ROWS = None
+""" If set, the most rows a :class:`BulkLoader` holds before writing them """
+
+MAX_PENDING_BYTES = None
+""" If set, the most bytes of rows a :class:`BulkLoader` holds before writing them """
+
+SPELL_CHUNK = 1000
+""" Number of spells expanded at a time by :func:`spell_years` """
 
 def camel2under(x):
     """Convert Camelcase words to underscore separated words
@@ -37,6 +68,82 @@ def row_ymd(row, y, m, d):
 def replmiss(x, f):
     return x if not f(x) else None
 
+def to_int(x):
+    """ Convert a string to int, allowing thousands separators """
+    try:
+        return int(x)
+    except ValueError:
+        return int(x.replace(',', ''))
+
+def to_bool(x):
+    """ Convert a string coded 0/1 to bool """
+    return to_int(x) != 0
+
+
+class Coercion(object):
+    """ Conversion of source rows to the column types of a table
+
+    Declares how the string values of a source file are converted
+    for a table: values in ``na`` become None, and everything else is
+    converted according to the type of its column in ``tbl``
+    (Integer, Float, and Boolean; other types are left as they are),
+    or by a function in ``converters``. Call :meth:`compile` with the
+    names of the source columns to get a function converting a row.
+
+    :param tbl: mapped class or :class:`Table`
+    :param na: source values denoting missing values, e.g. ``('-9', )``
+    :param converters: dict mapping source column names to functions.
+      These override the column types, and can also name source
+      columns which are not in the table.
+
+    """
+    TYPES = ((sa.types.Boolean, to_bool),
+             (sa.types.Integer, to_int),
+             (sa.types.Float, float))
+    """ Converters for column types, checked in order """
+
+    def __init__(self, tbl, na=(), converters=None):
+        self.table = getattr(tbl, '__table__', tbl)
+        self.na = frozenset(na)
+        self.converters = converters or {}
+
+    def converter(self, name):
+        """ Function converting values of source column name """
+        if name in self.converters:
+            return self.converters[name]
+        coltype = self.table.c[name].type
+        for _type, f in self.TYPES:
+            if isinstance(coltype, _type):
+                return f
+        return None
+
+    def compile(self, fieldnames):
+        """ Function converting a row of the source to a dict
+
+        Only source columns which are in the table or in
+        ``converters`` are converted and returned; the others are
+        never touched.
+
+        :param fieldnames: names of the columns in the source rows
+        :rtype: function taking a sequence of values and returning a dict
+        """
+        cols = [(i, k, self.converter(k)) for i, k in enumerate(fieldnames)
+                if k in self.table.c or k in self.converters]
+        na = self.na
+        def convert(row):
+            data = {}
+            for i, k, f in cols:
+                x = row[i]
+                if x is None or x in na:
+                    data[k] = None
+                elif f is None:
+                    data[k] = x
+                else:
+                    data[k] = f(x)
+            return data
+        return convert
+
+
 def load_from_yaml(src, tbl):
     """ Load from yaml file
 
@@ -75,6 +182,494 @@ def daterng(y, m, d):
     else:
         dt_min = dt_max = None
     return (dt_min, dt_max)
-                
+
+_DAYS_BEFORE_MONTH = [0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]
+
+def _jan1(y):
+    """ Proleptic Gregorian ordinal of January 1 of year y """
+    y -= 1
+    return 365 * y + y // 4 - y // 100 + y // 400 + 1
+
+def expand_spells(starts, ends, mid=(7, 2), inclusive=False):
+    """ Expand date spells into spell-years
+
+    Computes the years that each spell covers, and for each of those
+    years, whether the spell covers the first day, the day ``mid``,
+    and the last day of the year, and the fraction of the year it
+    covers. All spells are expanded together with arithmetic on
+    day ordinals, so no date objects are created per year.
+
+    :param starts: list of start dates of the spells
+    :param ends: list of end dates of the spells
+    :param mid: (month, day) tuple of the day defining ``mid_year``
+    :param inclusive: if True, count both the first and last days
+      covered in ``frac_year``; if False, the number of days between
+      them.
+    :rtype: dict of equal length lists with keys ``spell`` (index of
+      the spell in ``starts``), ``year``, ``start_year``, ``mid_year``,
+      ``end_year``, and ``frac_year``.
+
+    """
+    data = dict((k, []) for k in ('spell', 'year', 'start_year',
+                                  'mid_year', 'end_year', 'frac_year'))
+    if not starts:
+        return data
+    st = [x.toordinal() for x in starts]
+    en = [x.toordinal() for x in ends]
+    y0 = [x.year for x in starts]
+    y1 = [x.year for x in ends]
+    ## per-year ordinals, indexed by year - lo
+    lo = min(y0)
+    boy = [_jan1(y) for y in range(lo, max(y1) + 2)]
+    eoy = [b - 1 for b in boy[1:]]
+    ndays = [float(e - b + 1) for b, e in zip(boy, eoy)]
+    mid_offset = _DAYS_BEFORE_MONTH[mid[0]] + mid[1] - 1
+    moy = [b + mid_offset + (n == 366 and mid[0] > 2)
+           for b, n in zip(boy, ndays)]
+    ## expand spells to spell-years
+    spell = data['spell']
+    year = data['year']
+    for i in xrange(len(st)):
+        spell.extend([i] * (y1[i] - y0[i] + 1))
+        year.extend(xrange(y0[i], y1[i] + 1))
+    k = [y - lo for y in year]
+    s = [st[i] for i in spell]
+    e = [en[i] for i in spell]
+    data['start_year'] = [a <= boy[j] <= b for j, a, b in zip(k, s, e)]
+    data['mid_year'] = [a <= moy[j] <= b for j, a, b in zip(k, s, e)]
+    data['end_year'] = [a <= eoy[j] <= b for j, a, b in zip(k, s, e)]
+    extra = 1 if inclusive else 0
+    data['frac_year'] = [(min(eoy[j], b) - max(boy[j], a) + extra) / ndays[j]
+                         for j, a, b in zip(k, s, e)]
+    return data
+
+def spell_years(spells, start, end, mid=(7, 2), inclusive=False,
+                chunk_size=None):
+    """ Expand spells into spell-years, a chunk of spells at a time
+
+    Like :func:`expand_spells`, but only ``chunk_size`` spells are
+    expanded at once, so memory does not grow with the number of
+    spell-years.
+
+    :param spells: list of rows
+    :param start: name of the start date attribute of the rows
+    :param end: name of the end date attribute of the rows
+    :param chunk_size: Defaults to :data:`SPELL_CHUNK`
+    :return: iterator of ``(spell, values)``, where ``spell`` is a row
+      of spells and ``values`` a dict with keys ``year``,
+      ``start_year``, ``mid_year``, ``end_year``, and ``frac_year``.
+    """
+    chunk_size = chunk_size or SPELL_CHUNK
+    for i in xrange(0, len(spells), chunk_size):
+        chunk = spells[i:i + chunk_size]
+        data = expand_spells([getattr(x, start) for x in chunk],
+                             [getattr(x, end) for x in chunk],
+                             mid=mid, inclusive=inclusive)
+        keys = [k for k in data if k != 'spell']
+        for j, values in enumerate(zip(*[data[k] for k in keys])):
+            yield chunk[data['spell'][j]], dict(zip(keys, values))
+
+def _pg_date(y, m, d):
+    return "to_date(CAST(%s AS TEXT) || '-%02d-%02d', 'YYYY-MM-DD')" % (y, m, d)
+
+def _sqlite_date(y, m, d):
+    return "printf('%%04d-%02d-%02d', %s)" % (m, d, y)
+
+_SPELL_SQL = {
+    'postgresql': {'date': _pg_date,
+                   'year': "CAST(extract(year FROM %s) AS INTEGER)",
+                   'days': "(%s - %s)",
+                   'float': "CAST(%s AS DOUBLE PRECISION)",
+                   'least': "least(%s, %s)",
+                   'greatest': "greatest(%s, %s)"},
+    'sqlite': {'date': _sqlite_date,
+               'year': "CAST(substr(%s, 1, 4) AS INTEGER)",
+               'days': "(julianday(%s) - julianday(%s))",
+               'float': "CAST(%s AS REAL)",
+               'least': "min(%s, %s)",
+               'greatest': "max(%s, %s)"}}
+""" SQL fragments used by :func:`insert_spell_years` for each dialect """
+
+def insert_spell_years(src, dst, keys, start, end, mid=(7, 2),
+                       inclusive=False, flags=True, bind=None):
+    """ Expand spells into spell-years inside the database
+
+    The SQL equivalent of :func:`expand_spells`: a single
+    ``INSERT ... SELECT`` joining the spells in ``src`` to a
+    recursive series of years, and inserting the spell-years into
+    ``dst``. Supports PostgreSQL and SQLite.
+
+    :param src: :class:`Table` with the spells
+    :param dst: :class:`Table` into which to insert spell-years
+    :param keys: dict mapping columns in ``dst`` to columns in ``src``
+      copied to each spell-year
+    :param start: name of the column in ``src`` with start dates
+    :param end: name of the column in ``src`` with end dates
+    :param mid: see :func:`expand_spells`
+    :param inclusive: see :func:`expand_spells`
+    :param flags: if True, also insert ``start_year``, ``mid_year``,
+      ``end_year``, and ``frac_year``. Otherwise only ``year``.
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+
+    """
+    bind = bind if bind is not None else model.Base.metadata.bind
+    conn = bind.connect()
+    try:
+        dialect = conn.dialect.name
+        if dialect not in _SPELL_SQL:
+            raise ValueError("insert_spell_years does not support %s" % dialect)
+        f = _SPELL_SQL[dialect]
+        q = sa.select([sa.func.min(src.c[start]), sa.func.max(src.c[end])])
+        lo, hi = conn.execute(q).first()
+        if lo is None:
+            return
+        preparer = conn.dialect.identifier_preparer
+        quote = lambda tbl, k: preparer.format_column(tbl.c[k])
+        st = 'spells.%s' % quote(src, start)
+        en = 'spells.%s' % quote(src, end)
+        cols = [(k, 'spells.%s' % quote(src, v)) for k, v in keys.iteritems()]
+        cols.append(('year', 'years.year'))
+        if flags:
+            boy = f['date']('years.year', 1, 1)
+            eoy = f['date']('years.year', 12, 31)
+            moy = f['date']('years.year', *mid)
+            nboy = f['date']('years.year + 1', 1, 1)
+            days = f['days'] % (f['least'] % (eoy, en), f['greatest'] % (boy, st))
+            if inclusive:
+                days = '(%s + 1)' % days
+            cols.extend([
+                ('start_year', '(%s <= %s AND %s >= %s)' % (st, boy, en, boy)),
+                ('mid_year', '(%s <= %s AND %s >= %s)' % (st, moy, en, moy)),
+                ('end_year', '(%s <= %s AND %s >= %s)' % (st, eoy, en, eoy)),
+                ('frac_year', '%s / %s' % (f['float'] % days,
+                                           f['float'] % (f['days'] % (nboy, boy))))])
+        sql = ("INSERT INTO %(dst)s (%(dstcols)s) "
+               "WITH RECURSIVE years(year) AS "
+               "(SELECT CAST(:lo AS INTEGER) "
+               "UNION ALL SELECT year + 1 FROM years WHERE year < :hi) "
+               "SELECT %(srccols)s "
+               "FROM %(src)s AS spells JOIN years "
+               "ON years.year BETWEEN %(styear)s AND %(endyear)s" %
+               {'dst': preparer.format_table(dst),
+                'dstcols': ', '.join(quote(dst, k) for k, v in cols),
+                'srccols': ', '.join(v for k, v in cols),
+                'src': preparer.format_table(src),
+                'styear': f['year'] % st,
+                'endyear': f['year'] % en})
+        trans = conn.begin()
+        try:
+            conn.execute(sa.text(sql), lo=lo.year, hi=hi.year)
+            trans.commit()
+        except Exception:
+            trans.rollback()
+            raise
+    finally:
+        conn.close()
+
 def get_data(pth):
-    return StringIO(pkgutil.get_data("irdata", "data/%s" % pth))
+    """ File object of a packaged data file. See :mod:`irdata.resources` """
+    return resources.open_data(pth)
+
+def tuple_reader(src, **kwargs):
+    """ Reader of a large delimited file
+
+    A :class:`csv2.ChunkedReader` parsing the file in
+    :data:`PARSE_PROCESSES` processes, or a :class:`csv2.TupleReader`
+    if only one.
+    """
+    if PARSE_PROCESSES > 1:
+        return csv2.ChunkedReader(src, processes=PARSE_PROCESSES, **kwargs)
+    return csv2.TupleReader(src, **kwargs)
+
+
+def _row_bytes(row):
+    """ Approximate size of a row in memory """
+    return sys.getsizeof(row) + sum(sys.getsizeof(x) for x in row.itervalues())
+
+
+class BulkLoader(object):
+    """ Insert rows into tables in batches of executemany INSERTs
+
+    Rows are dicts keyed by column name. They are buffered per table
+    and written with :meth:`Table.insert` once any buffer holds
+    ``batch_size`` rows. Pending batches are always written in the
+    order in which the tables were first seen, so parents are inserted
+    before their children.
+
+    All batches are written on a single connection inside one
+    transaction, which is committed by :meth:`close`.
+
+    On PostgreSQL each batch is streamed with ``COPY ... FROM STDIN``
+    instead, unless :data:`USE_COPY` is false.
+
+    With ``background``, batches are written by a
+    :class:`irdata.load.pipeline.Writer` thread on a second connection
+    while rows are added, and :attr:`connection` is only used for reads.
+
+    Memory is bounded by ``batch_size`` rows per table. With
+    ``max_rows`` or ``max_bytes``, all pending rows are also written
+    once their number, or their estimated size, reaches the limit,
+    whatever the number of tables. A background writer holds at most
+    :data:`irdata.load.pipeline.DEPTH` more batches.
+
+    >>> with BulkLoader() as loader:
+    ...     loader.add(model.Version, {'version': u'6.0.0'})
+
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+    :param batch_size: number of rows per INSERT. Defaults to :data:`BATCH_SIZE`,
+       or :data:`COPY_BATCH_SIZE` when using COPY.
+    :param copy: use COPY. Defaults to :data:`USE_COPY` if the
+       database is PostgreSQL, and is False otherwise.
+    :param background: write in a background thread. Defaults to
+       :data:`PIPELINE`. Ignored if bind cannot have a second
+       connection, see :func:`irdata.load.pipeline.threadable`.
+    :param max_rows: Defaults to :data:`MAX_PENDING_ROWS`
+    :param max_bytes: Defaults to :data:`MAX_PENDING_BYTES`
+
+    """
+
+    def __init__(self, bind=None, batch_size=None, copy=None, background=None,
+                 max_rows=None, max_bytes=None):
+        bind = bind if bind is not None else model.Base.metadata.bind
+        self.connection = bind.connect()
+        if copy is None:
+            copy = USE_COPY
+        self.copy = copy and self.connection.dialect.name == 'postgresql'
+        if batch_size:
+            self.batch_size = batch_size
+        elif self.copy:
+            self.batch_size = COPY_BATCH_SIZE
+        else:
+            self.batch_size = BATCH_SIZE
+        self._transaction = self.connection.begin()
+        self._tables = []
+        self._batches = {}
+        self._pending = 0
+        self._pending_bytes = 0
+        self.max_rows = max_rows or MAX_PENDING_ROWS
+        self.max_bytes = max_bytes or MAX_PENDING_BYTES
+        if background is None:
+            background = PIPELINE
+        if background and pipeline.threadable(bind):
+            self._writer = pipeline.Writer(bind, self._write)
+        else:
+            self._writer = None
+
+    def add(self, tbl, row):
+        """ Queue a row for insertion
+
+        :param tbl: mapped class or :class:`Table`
+        :param row: dict of column name, value pairs.
+          Keys that are not columns of the table are ignored.
+        """
+        tbl = getattr(tbl, '__table__', tbl)
+        if tbl not in self._batches:
+            self._tables.append(tbl)
+            self._batches[tbl] = []
+        self._batches[tbl].append(row)
+        self._pending += 1
+        if self.max_bytes:
+            self._pending_bytes += _row_bytes(row)
+        if (len(self._batches[tbl]) >= self.batch_size
+            or (self.max_rows and self._pending >= self.max_rows)
+            or (self.max_bytes and self._pending_bytes >= self.max_bytes)):
+            self.flush()
+
+    def add_all(self, tbl, rows):
+        """ Queue several rows for insertion into the same table """
+        for row in rows:
+            self.add(tbl, row)
+
+    def _write(self, conn, batch):
+        tbl, rows = batch
+        if self.copy:
+            copy_rows(conn, tbl, rows)
+        else:
+            conn.execute(tbl.insert(), _normalize(tbl, rows))
+
+    def flush(self):
+        """ Write all pending rows to the database, or queue them for the writer thread """
+        for tbl in self._tables:
+            rows = self._batches[tbl]
+            if rows:
+                if self._writer is not None:
+                    self._writer.put((tbl, rows))
+                else:
+                    self._write(self.connection, (tbl, rows))
+                self._batches[tbl] = []
+        self._pending = 0
+        self._pending_bytes = 0
+
+    def close(self):
+        """ Flush pending rows and commit the transaction """
+        try:
+            self.flush()
+            if self._writer is not None:
+                self._writer.close()
+            self._transaction.commit()
+        finally:
+            if self._writer is not None:
+                self._writer.rollback()
+            self.connection.close()
+
+    def rollback(self):
+        """ Discard pending rows and roll back the transaction """
+        try:
+            if self._writer is not None:
+                self._writer.rollback()
+            self._transaction.rollback()
+        finally:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.rollback()
+
+
+def load_csv(src, sinks, encoding='utf-8', bind=None):
+    """ Read a csv file once and write its records to several tables
+
+    Each sink is a function which is called once with the field names
+    of the file (converted with :func:`camel2under`) and returns a
+    function. That function is called with the tuple of values of each
+    record, and returns an iterable of ``(table, row)`` pairs to
+    insert. All rows are written by one :class:`BulkLoader`, in one
+    transaction.
+
+    :param src: file object
+    :param sinks: list of sinks
+    :param encoding: encoding of the file
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+
+    """
+    reader = csv2.TupleReader(src, encoding=encoding)
+    reader.fieldnames = [camel2under(x) for x in reader.fieldnames]
+    routes = [sink(reader.fieldnames) for sink in sinks]
+    with BulkLoader(bind) as loader:
+        for values in reader:
+            for route in routes:
+                for tbl, row in route(values):
+                    loader.add(tbl, row)
+
+
+class KeySet(object):
+    """ Keys of the rows of a table
+
+    The keys already in the table are read once. Keys of new rows are
+    added with :meth:`add`, so rows can be deduplicated while loading
+    without a query, or a flush of a :class:`BulkLoader`, per row.
+
+    >>> seen = KeySet(model.War4Link, ['war_from', 'war_to'])
+    >>> if seen.add((war_from, war_to)):
+    ...     loader.add(model.War4Link, {'war_from': war_from, 'war_to': war_to})
+
+    :param tbl: table or mapped class
+    :param columns: names of the key columns. Keys are tuples, unless
+      there is only one column.
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+
+    """
+    def __init__(self, tbl, columns, bind=None):
+        bind = bind if bind is not None else model.Base.metadata.bind
+        tbl = getattr(tbl, '__table__', tbl)
+        q = sa.select([tbl.c[x] for x in columns])
+        if len(columns) == 1:
+            self.keys = set(row[0] for row in bind.execute(q))
+        else:
+            self.keys = set(tuple(row) for row in bind.execute(q))
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        """ Add a key
+
+        :return: True if the key is new, False if it was already present
+        """
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+def _normalize(tbl, rows):
+    """ Give every row in a batch the same set of table columns
+
+    executemany compiles a single statement for the whole batch,
+    so columns missing from some rows are filled with None.
+    """
+    keys = set()
+    for row in rows:
+        keys.update(row)
+    cols = [c.name for c in tbl.columns if c.name in keys]
+    return [dict((k, row.get(k)) for k in cols) for row in rows]
+
+
+def _copy_escape(x):
+    """ Escape a string for the PostgreSQL COPY text format """
+    return (x.replace('\\', '\\\\').replace('\t', '\\t').
+            replace('\n', '\\n').replace('\r', '\\r'))
+
+def _copy_converter(col):
+    """ Function formatting values of a column for the COPY text format """
+    integer = isinstance(col.type, sa.types.Integer)
+    def convert(x):
+        if x is None:
+            return '\\N'
+        elif isinstance(x, bool):
+            return 't' if x else 'f'
+        elif isinstance(x, float):
+            ## xlrd returns all numbers as floats
+            if integer and x.is_integer():
+                return str(int(x))
+            return repr(x)
+        elif isinstance(x, (datetime.date, datetime.datetime)):
+            return x.isoformat()
+        elif isinstance(x, unicode):
+            return _copy_escape(x.encode('utf-8'))
+        else:
+            return _copy_escape(str(x))
+    return convert
+
+def copy_rows(conn, tbl, rows):
+    """ Insert rows into a table with PostgreSQL COPY FROM STDIN
+
+    The rows are written in the COPY text format to a buffer that
+    is kept in memory up to :data:`COPY_SPOOL_SIZE` bytes, and then
+    streamed to the server on the DBAPI cursor of ``conn``, so the
+    COPY runs in the current transaction.
+
+    :param conn: connection to a PostgreSQL database (psycopg2)
+    :param tbl: :class:`Table`
+    :param rows: list of dicts
+    """
+    keys = set()
+    for row in rows:
+        keys.update(row)
+    cols = [c for c in tbl.columns if c.name in keys]
+    converters = [(c.name, _copy_converter(c)) for c in cols]
+    buf = tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE)
+    try:
+        for row in rows:
+            buf.write('\t'.join(f(row.get(k)) for k, f in converters))
+            buf.write('\n')
+        buf.seek(0)
+        preparer = conn.dialect.identifier_preparer
+        sql = "COPY %s (%s) FROM STDIN" % (
+            preparer.format_table(tbl),
+            ', '.join(preparer.format_column(c) for c in cols))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(sql, buf)
+        finally:
+            cursor.close()
+    finally:
+        buf.close()
@@ -1,6 +1,6 @@
 from irdata import model
 
-KLS = model.Version
+KLS = [model.Version]
 
 VERSION = "6.0.0"
 
@@ -8,6 +8,7 @@ import sqlalchemy as sa
 import yaml
 
 from irdata import csv2
+from irdata import cache
 from irdata import model
 from irdata.load import utils
 
@@ -21,49 +22,66 @@ KLS = [model.War3Outcome,
        model.War3Partic,
        model.War3ParticDate]
 
+DATA = ["war3_enum.yaml"]
+""" Files in irdata/data read by load_all """
+
+SOURCES = [path.join("www.correlatesofwar.org/cow2 data/WarData", x, y)
+           for x, wars, partic in
+           (("InterState", "Inter-State Wars (V 3-0).csv",
+             "Inter-State War Participants (V 3-0).csv"),
+            ("IntraState", "Intra-State Wars (V 3-0).csv",
+             "Intra-State War Participants (V 3-0).csv"),
+            ("ExtraState", "Extra-State Wars (V 3-0).csv",
+             "Extra-State War Participants (V 3-0).csv"))
+           for y in (wars, partic)]
+""" Files in the external data directory read by load_all, as
+pairs of wars and war participants """
+
+_DATE_PARTS = dict(('%s_%s%d' % (part, x, n), int)
+                   for part in ('yr', 'mon', 'day')
+                   for x in ('beg', 'end')
+                   for n in (1, 2))
+
+WAR3 = utils.Coercion(model.War3, na=('-999', '-888'),
+                      converters=_DATE_PARTS)
+WAR3_PARTIC = utils.Coercion(model.War3Partic, na=('-999', '-888'),
+                             converters=_DATE_PARTS)
+""" Conversion of the COW War v. 3 files; -999 and -888 are missing """
+
 def load_war3(src):
     """ Load COW War Data v. 3 """
 
-    session = model.SESSION()
-
-    def _int(x):
-        try:
-            return int(x)
-        except TypeError:
-            return None
+    loader = utils.BulkLoader()
 
     def _dates(row, n):
         if row['yr_beg%d' % n]:
-            y = model.War3Date()
-            y.war_no = row['war_no']
-            y.spell_no = n
-            date_beg = utils.daterng(_int(row['yr_beg%d' % n]),
-                                     _int(row['mon_beg%d' % n]),
-                                     _int(row['day_beg%d' % n]))
-            y.date_beg_min, y.date_beg_max = date_beg
-            date_end = utils.daterng(_int(row['yr_end%d' % n]),
-                                     _int(row['mon_end%d' % n]),
-                                     _int(row['day_end%d' % n]))
-            y.date_end_min, y.date_end_max = date_end
-            session.add(y)
-
-    reader = csv2.DictReader(src, encoding='latin1')
-    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
+            y = {}
+            y['war_no'] = row['war_no']
+            y['spell_no'] = n
+            date_beg = utils.daterng(row['yr_beg%d' % n],
+                                     row['mon_beg%d' % n],
+                                     row['day_beg%d' % n])
+            y['date_beg_min'], y['date_beg_max'] = date_beg
+            date_end = utils.daterng(row['yr_end%d' % n],
+                                     row['mon_end%d' % n],
+                                     row['day_end%d' % n])
+            y['date_end_min'], y['date_end_max'] = date_end
+            loader.add(model.War3Date, y)
 
-    war_cols = [x.name for x in model.War3.__table__.c]
-    war_date_cols = [x.name for x in model.War3Date.__table__.c]
-    for row in reader:
-        for k,v in row.iteritems():
-            row[k] = utils.replmiss(v, lambda x: x in ("-999", "-888"))
+    reader = csv2.TupleReader(src, encoding='latin1')
+    reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
+    convert = WAR3.compile(reader.fieldnames)
+    for values in reader:
+        row = convert(values)
         ## Inter-state war does not have a war_type
-        if 'war_type' not in row.keys():
+        if 'war_type' not in row:
             row['war_type'] = 1
         row['oceania'] = row['oceania'] if row['oceania'] else False
-        session.add(model.War3(**utils.subset(row, war_cols)))
+        loader.add(model.War3, row)
         ## Dates
         for i in (1, 2):
             _dates(row, i)
-    session.commit()
+    loader.close()
 
 def war_partic_pkey(war_no, state_num, partic_no):
     return "%s,%s,%s" % (war_no, state_num, partic_no)
@@ -71,34 +89,29 @@ def war_partic_pkey(war_no, state_num, partic_no):
     
 def load_war3_partic(src):
     """ Load COW War Data v. 3, Participants """
-    session = model.SESSION()
-    def _int(x):
-        try:
-            return int(x)
-        except TypeError:
-            return None
+    loader = utils.BulkLoader()
 
     def _dates(row, n):
         if row['yr_beg%d' % n]:
-            y = model.War3ParticDate()
-            y.war_partic = row['war_partic']
-            y.spell_no = n
-            date_beg = utils.daterng(_int(row['yr_beg%d' % n]),
-                                     _int(row['mon_beg%d' % n]),
-                                     _int(row['day_beg%d' % n]))
-            y.date_beg_min, y.date_beg_max = date_beg
-            date_end = utils.daterng(_int(row['yr_end%d' % n]),
-                                     _int(row['mon_end%d' % n]),
-                                     _int(row['day_end%d' % n]))
-            y.date_end_min, y.date_end_max = date_end
-            session.add(y)
-
-    reader = csv2.DictReader(src, encoding='latin1')
+            y = {}
+            y['war_partic'] = row['war_partic']
+            y['spell_no'] = n
+            date_beg = utils.daterng(row['yr_beg%d' % n],
+                                     row['mon_beg%d' % n],
+                                     row['day_beg%d' % n])
+            y['date_beg_min'], y['date_beg_max'] = date_beg
+            date_end = utils.daterng(row['yr_end%d' % n],
+                                     row['mon_end%d' % n],
+                                     row['day_end%d' % n])
+            y['date_end_min'], y['date_end_max'] = date_end
+            loader.add(model.War3ParticDate, y)
+
+    reader = csv2.TupleReader(src, encoding='latin1')
     reader.fieldnames = [utils.camel2under(x) for x in reader.fieldnames]
-    war_cols = [x.name for x in model.War3Partic.__table__.c]
-    war_date_cols = [x.name for x in model.War3ParticDate.__table__.c]
+    convert = WAR3_PARTIC.compile(reader.fieldnames)
     cnt = collections.Counter()
-    for row in reader:
+    for values in reader:
+        row = convert(values)
         ## Account for multiple country-war participations
         key = (row['war_no'], row['state_num'])
         cnt[key] += 1
@@ -106,14 +119,11 @@ def load_war3_partic(src):
         row['war_partic'] = war_partic_pkey(row['war_no'],
                                             row['state_num'],
                                             row['partic_no'])
-        ## replace missing values
-        for k,v in row.iteritems():
-            row[k] = utils.replmiss(v, lambda x: x in ("-999", "-888"))
-        session.add(model.War3Partic(**utils.subset(row, war_cols)))
+        loader.add(model.War3Partic, row)
         ## Dates
         for i in (1, 2):
              _dates(row, i)
-    session.commit()
+    loader.close()
 
 def unload():
     for x in reversed(KLS):
@@ -121,19 +131,9 @@ def unload():
 
 def load_all(external):
     """ Load all COW War Data v. 3 (Inter-, Intra-, and Extra-State)"""
-    utils.load_enum_from_yaml(utils.get_data("war3_enum.yaml"))
-    basepth = "www.correlatesofwar.org/cow2 data/WarData"
-    load_war3(open(path.join(external, basepth, "InterState",
-                             "Inter-State Wars (V 3-0).csv"), 'r'))
-    load_war3_partic(open(path.join(external, basepth, "InterState", 
-                                    "Inter-State War Participants (V 3-0).csv"), 'r'))
-    load_war3(open(path.join(external, basepth, "IntraState", 
-                             "Intra-State Wars (V 3-0).csv"), 'r'))
-    load_war3_partic(open(path.join(external, basepth, "IntraState",
-                                    "Intra-State War Participants (V 3-0).csv"), 'r'))
-    load_war3(open(path.join(external, basepth, "ExtraState",
-                             "Extra-State Wars (V 3-0).csv"), 'r'))
-    load_war3_partic(open(path.join(external, basepth, "ExtraState",
-                                    "Extra-State War Participants (V 3-0).csv"), 'r'))
+    utils.load_enum_from_yaml(utils.get_data(DATA[0]))
+    for wars, partic in zip(SOURCES[::2], SOURCES[1::2]):
+        load_war3(open(cache.resolve(external, wars), 'r'))
+        load_war3_partic(open(cache.resolve(external, partic), 'r'))
 
     
@@ -109,6 +109,14 @@ class Version(Base, Mixin):
     version = sa.Column(sa.Unicode, primary_key=True)
 
 
+class BuildState(Base, Mixin):
+    """ Digest of the inputs of each loader when it was last run """
+    __tablename__ = 'build_state'
+    loader = sa.Column(sa.Unicode, primary_key=True)
+    digest = sa.Column(sa.Unicode(40), nullable=False)
+    loaded_at = sa.Column(sa.DateTime, nullable=False)
+
+
 class CowState(Base, Mixin):
     """COW state numbers, abbrevations, and names
     """ 
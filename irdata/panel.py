@@ -0,0 +1,97 @@
+""" Dyad-year panels
+
+Generates every pair of system members in each year from the
+``cow_system`` or ``ksg_system`` state-year tables, with the direct
+contiguity of the pair from ``contdir``. Rows are produced in chunks,
+so a whole panel is never held in memory.
+
+>>> for chunk in dyad_years(years=(1900, 1950)):
+...     for ccode_a, ccode_b, year, conttype in chunk:
+...         pass
+
+"""
+import itertools
+
+import sqlalchemy as sa
+
+from irdata import model
+from irdata.query import IntervalIndex
+
+CHUNK_SIZE = 50000
+""" Default number of rows in each chunk """
+
+SYSTEMS = {'cow': model.CowSystem,
+           'ksg': model.KsgSystem}
+
+def contiguity_index(bind=None):
+    """ Index of the direct contiguity intervals of each pair of states
+
+    Keys are ``(statelno, statehno)`` with ``statelno < statehno``,
+    as in ``contdir``, and values are contiguity types.
+
+    :rtype: :class:`irdata.query.IntervalIndex`
+    """
+    bind = bind if bind is not None else model.Base.metadata.bind
+    tbl = model.ContDir.__table__
+    q = sa.select([tbl.c.statelno, tbl.c.statehno, tbl.c.start_date,
+                   tbl.c.end_date, tbl.c.conttype])
+    return IntervalIndex(((min(a, b), max(a, b)), start, end, conttype)
+                         for a, b, start, end, conttype in bind.execute(q))
+
+def members(system='cow', years=None, bind=None):
+    """ System members by year
+
+    :param system: ``'cow'`` or ``'ksg'``
+    :param years: ``(first, last)`` years to include, or None for all
+    :return: iterator of ``(year, ccodes)`` in order of year, where
+      ccodes is a sorted list.
+    """
+    bind = bind if bind is not None else model.Base.metadata.bind
+    tbl = SYSTEMS[system].__table__
+    q = sa.select([tbl.c.year, tbl.c.ccode]).order_by(tbl.c.year, tbl.c.ccode)
+    if years is not None:
+        q = q.where(tbl.c.year.between(*years))
+    rows = bind.execute(q)
+    for year, group in itertools.groupby(rows, lambda x: x[0]):
+        yield year, [x[1] for x in group]
+
+def dyad_years(system='cow', directed=True, years=None, contiguity=True,
+               chunk_size=CHUNK_SIZE, bind=None):
+    """ Dyad-year panel of system members
+
+    :param system: ``'cow'`` or ``'ksg'``
+    :param directed: include both ``(a, b)`` and ``(b, a)``. Otherwise
+      only pairs with ``a < b``.
+    :param years: ``(first, last)`` years to include, or None for all
+    :param contiguity: look up contiguity. If false, conttype is None.
+    :param chunk_size: approximate number of rows per chunk. Chunks
+      are only split between years.
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+    :return: iterator of lists of ``(ccode_a, ccode_b, year, conttype)``
+      tuples. ``conttype`` is the closest contiguity type (see
+      ``cont_type``) of the pair in any part of the year, or None if
+      the states were not directly contiguous.
+
+    """
+    index = contiguity_index(bind) if contiguity else None
+    pairs = itertools.permutations if directed else itertools.combinations
+    chunk = []
+    for year, ccodes in members(system, years, bind):
+        if index is None:
+            chunk.extend((a, b, year, None) for a, b in pairs(ccodes, 2))
+        else:
+            ## Look up each unordered pair once
+            cont = {}
+            present = set(ccodes)
+            for key in index.keys():
+                if key[0] in present and key[1] in present:
+                    types = index.in_year(key, year)
+                    if types:
+                        cont[key] = min(types)
+            chunk.extend((a, b, year, cont.get((a, b) if a < b else (b, a)))
+                         for a, b in pairs(ccodes, 2))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
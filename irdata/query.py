@@ -0,0 +1,162 @@
+""" In-process queries of state codes by date
+
+The membership and code-mapping tables store one row per interval
+in which a state existed, or in which a KSG state corresponded to a
+COW state. :class:`IntervalIndex` loads such a table once and answers
+point and year queries from sorted arrays, without a query per
+lookup. :class:`CodeTranslator` uses it to translate between COW and
+KSG state codes.
+
+>>> trans = CodeTranslator()
+>>> trans.cow_codes(260, datetime.date(1960, 1, 1))
+[260]
+>>> trans.ksg_to_cow_years([(260, 1960), (260, 1995)])
+[[260], [255]]
+
+"""
+import bisect
+import datetime
+
+import sqlalchemy as sa
+
+from irdata import model
+
+def _year_range(year):
+    return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+
+
+class IntervalIndex(object):
+    """ Index of closed intervals by key
+
+    The intervals of each key are sorted by start, with the running
+    maximum of their ends, so the intervals containing a point are
+    found with one binary search and a scan of the intervals which
+    can still contain it.
+
+    :param rows: iterable of ``(key, start, end, value)`` tuples.
+      Intervals include both ``start`` and ``end``. A missing start or
+      end is replaced by ``lo`` or ``hi``.
+    :param lo: lower bound of open intervals
+    :param hi: upper bound of open intervals
+
+    """
+    def __init__(self, rows, lo=datetime.date.min, hi=datetime.date.max):
+        intervals = {}
+        for key, start, end, value in rows:
+            intervals.setdefault(key, []).append((lo if start is None else start,
+                                                  hi if end is None else end,
+                                                  value))
+        self._index = {}
+        for key, x in intervals.iteritems():
+            x.sort()
+            max_end = []
+            for start, end, value in x:
+                max_end.append(max(end, max_end[-1]) if max_end else end)
+            self._index[key] = ([i[0] for i in x], [i[1] for i in x],
+                                [i[2] for i in x], max_end)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def overlapping(self, key, start, end):
+        """ Values of the intervals of key which overlap ``[start, end]``
+
+        :rtype: list, in the order of the start of the intervals
+        """
+        try:
+            starts, ends, values, max_end = self._index[key]
+        except KeyError:
+            return []
+        out = []
+        i = bisect.bisect_right(starts, end) - 1
+        while i >= 0 and max_end[i] >= start:
+            if ends[i] >= start:
+                out.append(values[i])
+            i -= 1
+        out.reverse()
+        return out
+
+    def at(self, key, point):
+        """ Values of the intervals of key which contain point """
+        return self.overlapping(key, point, point)
+
+    def in_year(self, key, year):
+        """ Values of the intervals of key which overlap a year """
+        return self.overlapping(key, *_year_range(year))
+
+    def years(self, pairs):
+        """ Values of the intervals overlapping each ``(key, year)`` pair
+
+        Results are cached by pair, so repeated pairs cost one dict
+        lookup and a copy. Each list returned is a new one.
+
+        :rtype: list of lists of values
+        """
+        cache = {}
+        out = []
+        for pair in pairs:
+            try:
+                values = cache[pair]
+            except KeyError:
+                values = cache[pair] = self.in_year(*pair)
+            out.append(list(values))
+        return out
+
+
+def _intervals(tbl, key, start, end, value, bind=None):
+    bind = bind if bind is not None else model.Base.metadata.bind
+    tbl = getattr(tbl, '__table__', tbl)
+    q = sa.select([tbl.c[key], tbl.c[start], tbl.c[end], tbl.c[value]])
+    return IntervalIndex(bind.execute(q))
+
+def cow_membership(bind=None):
+    """ Index of the intervals of COW system membership by ccode
+
+    The values are the interval numbers.
+    """
+    return _intervals(model.CowSysMembership, 'ccode', 'st_date',
+                      'end_date', 'interval', bind)
+
+def ksg_membership(bind=None):
+    """ Index of the intervals of KSG system membership by ccode
+
+    The values are the interval numbers.
+    """
+    return _intervals(model.KsgSysMembership, 'ccode', 'start_date',
+                      'end_date', 'interval', bind)
+
+
+class CodeTranslator(object):
+    """ Translate between KSG and COW state codes
+
+    Loads table ``ksg_to_cow`` once. A state-year is matched to every
+    code whose interval overlaps the year, as in table
+    ``ksg_to_cow_year``.
+
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+
+    """
+    def __init__(self, bind=None):
+        self.ksg_to_cow = _intervals(model.KsgToCow, 'ksg_ccode', 'start_date',
+                                     'end_date', 'cow_ccode', bind)
+        self.cow_to_ksg = _intervals(model.KsgToCow, 'cow_ccode', 'start_date',
+                                     'end_date', 'ksg_ccode', bind)
+
+    def cow_codes(self, ksg_ccode, date):
+        """ COW codes of a KSG state on a date """
+        return self.ksg_to_cow.at(ksg_ccode, date)
+
+    def ksg_codes(self, cow_ccode, date):
+        """ KSG codes of a COW state on a date """
+        return self.cow_to_ksg.at(cow_ccode, date)
+
+    def ksg_to_cow_years(self, pairs):
+        """ COW codes of each ``(ksg_ccode, year)`` pair """
+        return self.ksg_to_cow.years(pairs)
+
+    def cow_to_ksg_years(self, pairs):
+        """ KSG codes of each ``(cow_ccode, year)`` pair """
+        return self.cow_to_ksg.years(pairs)
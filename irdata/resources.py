@@ -0,0 +1,60 @@
+""" Packaged data files
+
+Files in irdata/data are read once and kept for the rest of the
+build. When the package is installed as files on disk they are
+memory-mapped, so their contents are paged in by the operating system
+rather than copied into strings; from a zipped install they are read
+with :func:`pkgutil.get_data`. Each :func:`open_data` returns a new
+file object over the same buffer, without copying it.
+
+"""
+import os
+import mmap
+import pkgutil
+from os import path
+from cStringIO import StringIO
+
+DATA_DIR = path.join(path.dirname(path.abspath(__file__)), 'data')
+""" Directory of the packaged data files, if installed on disk """
+
+_buffers = {}
+
+def _map(filename):
+    with open(filename, 'rb') as f:
+        ## Empty files cannot be mapped
+        if not os.fstat(f.fileno()).st_size:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def data(name):
+    """ Contents of a packaged data file
+
+    :param name: path relative to irdata/data
+    :return: read-only :class:`mmap.mmap` or str. Both support the
+      buffer interface.
+    """
+    try:
+        return _buffers[name]
+    except KeyError:
+        pass
+    filename = path.join(DATA_DIR, name)
+    if path.isfile(filename):
+        buf = _map(filename)
+    else:
+        buf = pkgutil.get_data("irdata", "data/%s" % name)
+    _buffers[name] = buf
+    return buf
+
+def open_data(name):
+    """ Read-only file object of a packaged data file
+
+    Iterating over it yields lines.
+    """
+    return StringIO(data(name))
+
+def clear():
+    """ Forget all files read
+
+    Buffers are unmapped once no file object uses them.
+    """
+    _buffers.clear()
@@ -0,0 +1,371 @@
+""" Columnar snapshots of the irdata database
+
+A snapshot is a directory with one subdirectory per table, and one or
+more files per column, in the NumPy ``.npy`` format. ``.npy`` files
+are raw little-endian arrays with a short header, so they can be
+written without any dependencies, memory-mapped, and read by numpy
+(``numpy.load(filename, mmap_mode='r')``) and by R (e.g. RcppCNPy).
+The file ``snapshot.yaml`` describes the tables and columns.
+
+Columns are stored as follows
+
+- Boolean, Integer, Float: ``<column>.npy`` with dtype ``|b1``,
+  ``<i8`` and ``<f8``.
+- Date and DateTime: ``<column>.npy`` with dtype ``<M8[D]`` and
+  ``<M8[us]``.
+- String: the UTF-8 encoded values are concatenated in
+  ``<column>.data.npy`` (``|u1``), and ``<column>.offsets.npy``
+  (``<i8``) has the offsets of the start and end of each value.
+- Columns referencing the ``value`` column of a factor table (see
+  :class:`irdata.model.FactorMixin`) are dictionary encoded:
+  ``<column>.npy`` (``<i4``) has indices into the ``levels`` and
+  ``labels`` of the column in ``snapshot.yaml``, and -1 if missing.
+
+Missing values of other columns are recorded in ``<column>.null.npy``
+(``|b1``), which is only written if the column has any.
+
+:func:`write` exports a database, and :class:`Snapshot` reads a
+snapshot by memory mapping its files.
+
+"""
+import os
+import datetime
+import mmap
+import struct
+import ast
+import argparse
+from os import path
+
+import sqlalchemy as sa
+import yaml
+
+from irdata import model
+
+INDEX = 'snapshot.yaml'
+
+_MAGIC = '\x93NUMPY\x01\x00'
+_EPOCH = datetime.date(1970, 1, 1)
+_EPOCH_DT = datetime.datetime(1970, 1, 1)
+_NAT = -2 ** 63
+
+def write_npy(filename, descr, data, n):
+    """ Write a one-dimensional array in ``.npy`` format
+
+    :param descr: numpy dtype string, e.g. ``'<i8'``
+    :param data: raw bytes of the array
+    :param n: number of elements
+    """
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': (n, )})
+    ## Data is aligned on 64 bytes, and the header ends with a newline
+    pad = 64 - (len(_MAGIC) + 2 + len(header) + 1) % 64
+    header = header + ' ' * (pad % 64) + '\n'
+    with open(filename, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<H', len(header)))
+        f.write(header)
+        f.write(data)
+
+
+class MappedArray(object):
+    """ Memory-mapped one-dimensional ``.npy`` array
+
+    Elements are unpacked on access. :meth:`numpy` returns a numpy
+    array backed by the same memory.
+    """
+    _FORMATS = {'|b1': '?', '<i4': 'i', '<i8': 'q', '<f8': 'd',
+                '<M8[D]': 'q', '<M8[us]': 'q', '|u1': 'B'}
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:6] != _MAGIC[:6]:
+            raise ValueError("%s is not a .npy file" % filename)
+        if self._mmap[6] == '\x01':
+            hlen, = struct.unpack_from('<H', self._mmap, 8)
+            self.offset = 10 + hlen
+        else:
+            hlen, = struct.unpack_from('<I', self._mmap, 8)
+            self.offset = 12 + hlen
+        header = ast.literal_eval(self._mmap[self.offset - hlen:self.offset])
+        self.dtype = header['descr']
+        self.shape = header['shape']
+        self._format = '<' + self._FORMATS[self.dtype]
+        self.itemsize = struct.calcsize(self._format)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return struct.unpack_from(self._format, self._mmap,
+                                  self.offset + i * self.itemsize)[0]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def bytes(self, start, stop):
+        """ Raw bytes of elements start to stop """
+        return self._mmap[self.offset + start * self.itemsize:
+                          self.offset + stop * self.itemsize]
+
+    def numpy(self):
+        """ numpy array sharing memory with the file """
+        import numpy
+        return numpy.frombuffer(self._mmap, dtype=self.dtype,
+                                count=len(self), offset=self.offset)
+
+
+def _factor_tables():
+    return set(kls.__table__ for kls in model.Base._decl_class_registry.values()
+               if isinstance(kls, type) and issubclass(kls, model.FactorMixin))
+
+def _factor(col, factors):
+    """ Factor table referenced by col, if any """
+    for fk in col.foreign_keys:
+        if fk.column.table in factors and fk.column.name == 'value':
+            return fk.column.table
+
+def _kind(col):
+    t = col.type
+    if isinstance(t, sa.types.Boolean):
+        return 'bool'
+    elif isinstance(t, sa.types.Integer):
+        return 'int'
+    elif isinstance(t, (sa.types.Float, sa.types.Numeric)):
+        return 'float'
+    elif isinstance(t, sa.types.DateTime):
+        return 'datetime'
+    elif isinstance(t, sa.types.Date):
+        return 'date'
+    elif isinstance(t, sa.types.String):
+        return 'string'
+    raise TypeError("cannot export column %s of type %r" % (col, t))
+
+def _write_column(dirname, col, values, kind, levels=None):
+    """ Write the values of a column. Returns its description """
+    n = len(values)
+    fname = path.join(dirname, col.name)
+    desc = {'name': col.name, 'type': kind}
+    nulls = [x is None for x in values]
+    if kind == 'factor':
+        index = dict((v, i) for i, v in enumerate(levels))
+        codes = [-1 if x is None else index[x] for x in values]
+        write_npy(fname + '.npy', '<i4', struct.pack('<%di' % n, *codes), n)
+        return desc
+    if kind == 'string':
+        data = [x.encode('utf-8') if isinstance(x, unicode) else (x or '')
+                for x in values]
+        offsets = [0]
+        for x in data:
+            offsets.append(offsets[-1] + len(x))
+        data = ''.join(data)
+        write_npy(fname + '.data.npy', '|u1', data, len(data))
+        write_npy(fname + '.offsets.npy', '<i8',
+                  struct.pack('<%dq' % (n + 1), *offsets), n + 1)
+    elif kind == 'bool':
+        write_npy(fname + '.npy', '|b1',
+                  struct.pack('<%d?' % n, *[bool(x) for x in values]), n)
+    elif kind == 'int':
+        write_npy(fname + '.npy', '<i8',
+                  struct.pack('<%dq' % n, *[x or 0 for x in values]), n)
+    elif kind == 'float':
+        write_npy(fname + '.npy', '<f8',
+                  struct.pack('<%dd' % n, *[float('nan') if x is None else float(x)
+                                            for x in values]), n)
+    elif kind == 'date':
+        write_npy(fname + '.npy', '<M8[D]',
+                  struct.pack('<%dq' % n, *[_NAT if x is None
+                                            else (x - _EPOCH).days
+                                            for x in values]), n)
+    elif kind == 'datetime':
+        def us(x):
+            d = x - _EPOCH_DT
+            return (d.days * 86400 + d.seconds) * 1000000 + d.microseconds
+        write_npy(fname + '.npy', '<M8[us]',
+                  struct.pack('<%dq' % n, *[_NAT if x is None else us(x)
+                                            for x in values]), n)
+    if any(nulls):
+        write_npy(fname + '.null.npy', '|b1', struct.pack('<%d?' % n, *nulls), n)
+    return desc
+
+def write_table(dirname, tbl, bind=None):
+    """ Write a table to directory dirname
+
+    :return: dict describing the table in ``snapshot.yaml``
+    """
+    bind = bind if bind is not None else model.Base.metadata.bind
+    factors = _factor_tables()
+    if not path.isdir(dirname):
+        os.makedirs(dirname)
+    q = tbl.select().order_by(*tbl.primary_key.columns)
+    rows = bind.execute(q).fetchall()
+    columns = []
+    for i, col in enumerate(tbl.c):
+        values = [row[i] for row in rows]
+        ftbl = _factor(col, factors)
+        if ftbl is not None:
+            lq = sa.select([ftbl.c.value, ftbl.c.label]).order_by(ftbl.c.value)
+            levels = bind.execute(lq).fetchall()
+            labels = [x[1] for x in levels]
+            levels = [x[0] for x in levels]
+            ## Values missing from the factor table
+            for x in sorted(set(values) - set(levels) - set([None])):
+                levels.append(x)
+                labels.append(None)
+            desc = _write_column(dirname, col, values, 'factor', levels)
+            desc['levels'] = levels
+            desc['labels'] = labels
+        else:
+            desc = _write_column(dirname, col, values, _kind(col))
+        columns.append(desc)
+    return {'rows': len(rows), 'columns': columns}
+
+def write(dirname, tables=None, bind=None):
+    """ Write a snapshot of the database
+
+    :param dirname: directory to write the snapshot to
+    :param tables: names of the tables to write. Defaults to all tables
+      in ``model.Base.metadata``.
+    :param bind: engine or connection. Defaults to ``model.Base.metadata.bind``.
+
+    """
+    if tables is None:
+        tables = [x.name for x in model.Base.metadata.sorted_tables]
+    index = {'tables': {}}
+    for name in tables:
+        tbl = model.Base.metadata.tables[name]
+        index['tables'][name] = write_table(path.join(dirname, name), tbl, bind)
+    with open(path.join(dirname, INDEX), 'w') as f:
+        yaml.safe_dump(index, f, default_flow_style=False, allow_unicode=True)
+
+
+class Column(object):
+    """ Column of a snapshot table
+
+    Values are decoded on access, with None for missing values.
+
+    :ivar values: :class:`MappedArray` with the values, the codes of a
+      factor, or the UTF-8 data of a string column.
+    :ivar nulls: :class:`MappedArray` which is true for missing values,
+      or None.
+    :ivar offsets: :class:`MappedArray` with the offsets of the values
+      of a string column, or None.
+    :ivar levels: levels of a factor column, or None.
+    :ivar labels: labels of the levels of a factor column, or None.
+    """
+    def __init__(self, dirname, desc):
+        fname = path.join(dirname, desc['name'])
+        self.name = desc['name']
+        self.type = desc['type']
+        self.levels = desc.get('levels')
+        self.labels = desc.get('labels')
+        self.offsets = None
+        self.nulls = None
+        if self.type == 'string':
+            self.values = MappedArray(fname + '.data.npy')
+            self.offsets = MappedArray(fname + '.offsets.npy')
+        else:
+            self.values = MappedArray(fname + '.npy')
+        if path.exists(fname + '.null.npy'):
+            self.nulls = MappedArray(fname + '.null.npy')
+
+    def __len__(self):
+        if self.offsets is not None:
+            return len(self.offsets) - 1
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        if self.type == 'string':
+            return self.values.bytes(self.offsets[i],
+                                     self.offsets[i + 1]).decode('utf-8')
+        x = self.values[i]
+        if self.type == 'factor':
+            return None if x < 0 else self.levels[x]
+        elif self.type == 'date':
+            return _EPOCH + datetime.timedelta(days=x)
+        elif self.type == 'datetime':
+            return _EPOCH_DT + datetime.timedelta(microseconds=x)
+        return x
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+class Table(object):
+    """ Table of a snapshot
+
+    Columns are memory mapped when first accessed, as ``table[name]``.
+    """
+    def __init__(self, dirname, desc):
+        self.dirname = dirname
+        self.nrows = desc['rows']
+        self._desc = dict((x['name'], x) for x in desc['columns'])
+        self.columns = [x['name'] for x in desc['columns']]
+        self._columns = {}
+
+    def __len__(self):
+        return self.nrows
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = Column(self.dirname, self._desc[name])
+        return self._columns[name]
+
+    def rows(self):
+        """ Iterate over rows as tuples """
+        cols = [self[x] for x in self.columns]
+        for i in xrange(self.nrows):
+            yield tuple(c[i] for c in cols)
+
+
+class Snapshot(object):
+    """ Read a snapshot written by :func:`write`
+
+    >>> snap = Snapshot('irdata-snapshot')
+    >>> nmc = snap['nmc']
+    >>> milex = nmc['milex'].values.numpy()
+
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(path.join(dirname, INDEX)) as f:
+            self._index = yaml.safe_load(f)['tables']
+        self.tables = sorted(self._index)
+        self._tables = {}
+
+    def __getitem__(self, name):
+        if name not in self._tables:
+            self._tables[name] = Table(path.join(self.dirname, name),
+                                       self._index[name])
+        return self._tables[name]
+
+
+def main():
+    """ Write a snapshot of an irdata database """
+    parser = argparse.ArgumentParser(description='Write a columnar snapshot of the irdata database.')
+    parser.add_argument('-t', '--table', metavar="TABLE", default=None,
+                        dest='tables', action='append',
+                        help='table to write. May be repeated. Default: all tables.')
+    parser.add_argument('engine', metavar="ENGINE",
+                        type=str, help='database engine')
+    parser.add_argument('directory', metavar='dir',
+                        type=str, help='directory in which to write the snapshot')
+    opts = parser.parse_args()
+    model.Base.metadata.bind = sa.create_engine(opts.engine)
+    write(opts.directory, opts.tables)
+
+if __name__ == '__main__':
+    main()
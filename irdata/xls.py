@@ -1,34 +1,130 @@
-""" Utility functions for dealing with xls spreadsheets """
+""" Utility functions for dealing with xls spreadsheets
+
+Parsing a workbook with xlrd is slow, so the values of each sheet
+read are saved in a sidecar file, named with the SHA-1 digest of the
+workbook, and read from it while the workbook is unchanged. Sidecar
+files store the sheet by columns, in :mod:`marshal` format. Writing
+the sidecar of a new version of a workbook removes those of the older
+versions.
+
+"""
+import os
+import re
+import hashlib
+import marshal
+import itertools
+from os import path
+
 import xlrd
 
+SIDECAR = True
+""" Save parsed sheets in sidecar files """
+
+CACHE_DIR = None
+""" Directory of sidecar files. If None, they are written beside the workbook """
+
+_SIDECAR_VERSION = 1
+
+def _digest(filename, size=1 << 20):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def sidecar_path(filename, sheet=0):
+    """ Path of the sidecar file of a sheet of a workbook """
+    dirname = CACHE_DIR or path.dirname(path.abspath(filename))
+    return path.join(dirname, '%s.%s-%d.xlsc' % (path.basename(filename),
+                                                 _digest(filename), sheet))
+
+def _prune(sidecar):
+    """ Remove the sidecar files of older versions of the same sheet """
+    dirname, name = path.split(sidecar)
+    book, sheet = re.match(r'(.*)\.[0-9a-f]{40}(-\d+\.xlsc)$', name).groups()
+    pattern = re.compile(re.escape(book) + r'\.[0-9a-f]{40}' +
+                         re.escape(sheet) + '$')
+    for x in os.listdir(dirname):
+        if x != name and pattern.match(x):
+            os.remove(path.join(dirname, x))
+
+def read_columns(filename, sheet=0):
+    """ Values of each column of a sheet of a workbook
+
+    The workbook is opened with ``on_demand``, so that only the sheet
+    read is parsed.
+
+    :rtype: list of lists
+    """
+    book = xlrd.open_workbook(filename, on_demand=True)
+    try:
+        s = book.sheet_by_index(sheet)
+        return [s.col_values(j) for j in range(s.ncols)]
+    finally:
+        book.release_resources()
+
+def columns(filename, sheet=0):
+    """ Like :func:`read_columns`, but through the sidecar file if :data:`SIDECAR` """
+    if not SIDECAR:
+        return read_columns(filename, sheet)
+    sidecar = sidecar_path(filename, sheet)
+    try:
+        with open(sidecar, 'rb') as f:
+            version, cols = marshal.load(f)
+        if version == _SIDECAR_VERSION:
+            return cols
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+    cols = read_columns(filename, sheet)
+    ## The sidecar is only an optimization, so failing to write it
+    ## is not an error
+    tmp = sidecar + '.tmp'
+    try:
+        if not path.exists(path.dirname(sidecar)):
+            os.makedirs(path.dirname(sidecar))
+        with open(tmp, 'wb') as f:
+            marshal.dump((_SIDECAR_VERSION, cols), f)
+        os.rename(tmp, sidecar)
+        _prune(sidecar)
+    except (IOError, OSError):
+        pass
+    return cols
+
+
 class Reader(object):
     """Reader object to iterate over rows of an Excel Spreadsheet
 
     :param f: path to .xls file
     :param sheet: index of sheet to read
     :param na: parameter
+    :param converters: dict of functions applied to the non-missing
+      values of columns, by column index
 
     Returns each row as a list.
 
     """
 
-    def __init__(self, f, sheet=0, na=['']):
-
-        self._book = xlrd.open_workbook(f)
-        self.sheet = self._book.sheet_by_index(sheet)
+    def __init__(self, f, sheet=0, na=[''], converters=None):
+        cols = columns(f, sheet)
+        self.nrows = len(cols[0]) if cols else 0
         self.na = na
+        self.converters = dict(converters or {})
         self.current_row = -1
+        self._rows = itertools.izip(*cols)
 
     def _to_none(self, row):
         return [x if x not in self.na else None for x in row]
 
     def next(self):
+        row = self._to_none(self._rows.next())
         self.current_row += 1
-        if (self.current_row >= self.sheet.nrows):
-            raise StopIteration
-        else:
-            row = self.sheet.row_values(self.current_row)
-            return self._to_none(row)
+        for i, f in self.converters.iteritems():
+            if row[i] is not None:
+                row[i] = f(row[i])
+        return row
 
     def __iter__(self):
         return self
@@ -45,17 +141,22 @@ class DictReader(Reader):
     :param f: path to .xls file
     :param sheet: index of sheet to read
     :param fieldnames: names of columns
+    :param converters: dict of functions applied to the non-missing
+      values of columns, by column name. Names which are not in
+      fieldnames are ignored.
     :param **kwds: passed to :function:`Reader.__init__`
 
     """
-    def __init__(self, f, sheet=0, fieldnames=None, **kwds):
+    def __init__(self, f, sheet=0, fieldnames=None, converters=None, **kwds):
         super(DictReader, self).__init__(f, sheet=sheet, **kwds)
         if fieldnames:
             self.fieldnames = fieldnames
         else:
             self.fieldnames = super(DictReader, self).next()
+        self.converters = dict((self.fieldnames.index(k), v)
+                               for k, v in (converters or {}).iteritems()
+                               if k in self.fieldnames)
 
     def next(self):
         row = super(DictReader, self).next()
         return dict(zip(self.fieldnames, row))
-
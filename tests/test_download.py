@@ -0,0 +1,158 @@
+""" Tests of irdata.download against a local HTTP server
+
+Run with ``python -m unittest discover tests``.
+"""
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+from os import path
+
+import yaml
+
+from irdata import download
+
+BODY = ''.join(chr(i % 251) for i in range(300000))
+ETAG = '"v1"'
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, headers, body=''):
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.log.append((self.path, dict(self.headers)))
+        if self.path == '/moved':
+            return self._send(302, [('Location', '/data.csv')])
+        if self.path != '/data.csv':
+            return self._send(404, [])
+        if self.headers.get('if-none-match') == ETAG:
+            return self._send(304, [('ETag', ETAG)])
+        rng = self.headers.get('range')
+        if rng and self.headers.get('if-range') == ETAG:
+            start = int(rng[len('bytes='):-1])
+            return self._send(206, [('ETag', ETAG),
+                                    ('Content-Range', 'bytes %d-%d/%d' %
+                                     (start, len(BODY) - 1, len(BODY)))],
+                              BODY[start:])
+        if server.stall is None:
+            return self._send(200, [('ETag', ETAG)], BODY)
+        ## Send half of the body, then wait until the client is killed
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY[:len(BODY) // 2])
+        self.wfile.flush()
+        server.stall.wait(30)
+        self.close_connection = 1
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        ## the killed client resets the connection
+        pass
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.log = []
+        self.server.stall = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.root = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.dirname = tempfile.mkdtemp()
+        self.dst = path.join(self.dirname, 'dst')
+
+    def tearDown(self):
+        if self.server.stall is not None:
+            self.server.stall.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dirname)
+
+    def filelist(self, entries):
+        filename = path.join(self.dirname, 'filelist.yaml')
+        with open(filename, 'w') as f:
+            yaml.safe_dump(entries, f)
+        return filename
+
+    def local(self, url):
+        return download.local_path(url, self.dst)
+
+    def read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_not_modified(self):
+        url = self.root + '/data.csv'
+        filelist = self.filelist([url])
+        self.assertEqual(download.download_all(self.dst, filelist=filelist), [url])
+        self.assertEqual(self.read(self.local(url)), BODY)
+        self.assertEqual(download.download_all(self.dst, filelist=filelist), [])
+        self.assertEqual(self.server.log[-1][1].get('if-none-match'), ETAG)
+
+    def test_redirect(self):
+        url = self.root + '/moved'
+        filelist = self.filelist([url])
+        self.assertEqual(download.download_all(self.dst, filelist=filelist), [url])
+        self.assertEqual(self.read(self.local(url)), BODY)
+        self.assertEqual([x[0] for x in self.server.log], ['/moved', '/data.csv'])
+
+    def test_checksum(self):
+        url = self.root + '/data.csv'
+        good = hashlib.sha256(BODY).hexdigest()
+        filelist = self.filelist([{'url': url, 'sha256': '0' * 64}])
+        self.assertRaises(RuntimeError, download.download_all, self.dst,
+                          filelist=filelist)
+        self.assertFalse(path.exists(self.local(url)))
+        self.assertFalse(path.exists(self.local(url) + '.part'))
+        filelist = self.filelist([{'url': url, 'sha256': good}])
+        self.assertEqual(download.download_all(self.dst, filelist=filelist), [url])
+
+    def test_resume_after_kill(self):
+        url = self.root + '/data.csv'
+        filelist = self.filelist([url])
+        part = self.local(url) + '.part'
+        self.server.stall = threading.Event()
+        proc = multiprocessing.Process(target=download.download_all,
+                                       args=(self.dst, ),
+                                       kwargs={'filelist': filelist})
+        proc.start()
+        deadline = time.time() + 30
+        while not (path.exists(part) and path.getsize(part)):
+            self.assertTrue(time.time() < deadline, "download did not start")
+            time.sleep(0.05)
+        proc.terminate()
+        proc.join()
+        offset = path.getsize(part)
+        self.server.stall.set()
+        self.server.stall = None
+        self.assertEqual(download.download_all(self.dst, filelist=filelist), [url])
+        self.assertEqual(self.read(self.local(url)), BODY)
+        headers = self.server.log[-1][1]
+        self.assertEqual(headers.get('range'), 'bytes=%d-' % offset)
+        self.assertEqual(headers.get('if-range'), ETAG)
+
+if __name__ == '__main__':
+    unittest.main()
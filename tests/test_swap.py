@@ -0,0 +1,124 @@
+""" Tests of irdata.load.swap
+
+The PostgreSQL tests are run if ``IRDATA_TEST_POSTGRESQL`` is the url
+of a database which they may empty, e.g.
+``postgresql://postgres@localhost/irdata_test``.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import sqlalchemy as sa
+
+from irdata import model
+from irdata.load import swap, schedule, cow_states
+from benchmarks import inputs
+
+LOADERS = ['version', 'cow_states', 'ksg_states']
+""" Loaders whose synthetic inputs reference no other loader """
+
+POSTGRESQL = os.environ.get('IRDATA_TEST_POSTGRESQL')
+
+class SwapTests(object):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.external = tempfile.mkdtemp()
+        inputs.generate(cls.external, 1)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.external)
+
+    def setUp(self):
+        self.loaders = schedule.LOADERS[:]
+        schedule.LOADERS[:] = LOADERS
+        self.load_cow_states = cow_states.load_all
+        self.live = sa.create_engine(self.url)
+
+    def tearDown(self):
+        schedule.LOADERS[:] = self.loaders
+        cow_states.load_all = self.load_cow_states
+        self.live.dispose()
+
+    def count(self, name):
+        return self.live.execute("SELECT COUNT(*) FROM %s" % name).scalar()
+
+    def test_swap(self):
+        swap.build(self.url, self.external)
+        n = self.count('cow_statelist')
+        self.assertTrue(n > 0)
+        ## mid is not loaded by the build, so its tables are copied
+        self.live.execute("INSERT INTO mid_outcome (value, label) VALUES (1, 'x')")
+        swap.build(self.url, self.external)
+        self.assertEqual(self.count('cow_statelist'), n)
+        self.assertEqual(self.count('mid_outcome'), 1)
+
+    def test_failed_build(self):
+        swap.build(self.url, self.external)
+        n = self.count('cow_statelist')
+        cow_states.load_all = lambda external: None
+        self.assertRaises(ValueError, swap.build, self.url, self.external)
+        self.assertEqual(self.count('cow_statelist'), n)
+
+
+class SQLiteSwapTest(SwapTests, unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.url = 'sqlite:///%s' % path.join(self.dirname, 'irdata.db')
+        super(SQLiteSwapTest, self).setUp()
+
+    def tearDown(self):
+        super(SQLiteSwapTest, self).tearDown()
+        shutil.rmtree(self.dirname)
+
+
+@unittest.skipUnless(POSTGRESQL, "IRDATA_TEST_POSTGRESQL is not set")
+class PostgreSQLSwapTest(SwapTests, unittest.TestCase):
+    url = POSTGRESQL
+
+    def setUp(self):
+        super(PostgreSQLSwapTest, self).setUp()
+        self._clean()
+
+    def tearDown(self):
+        self._clean()
+        super(PostgreSQLSwapTest, self).tearDown()
+
+    def _clean(self):
+        self.live.execute("DROP VIEW IF EXISTS irdata_test_view")
+        model.Base.metadata.drop_all(self.live)
+        for x in self.schemas():
+            self.live.execute('DROP SCHEMA "%s" CASCADE' % x)
+
+    def schemas(self):
+        q = "SELECT nspname FROM pg_namespace WHERE nspname LIKE 'irdata%%'"
+        return [x[0] for x in self.live.execute(q)]
+
+    def test_schemas_dropped(self):
+        swap.build(self.url, self.external)
+        self.assertEqual(swap.build(self.url, self.external), None)
+        self.assertEqual(self.schemas(), [])
+
+    def test_failed_build_drops_staging(self):
+        swap.build(self.url, self.external)
+        cow_states.load_all = lambda external: None
+        self.assertRaises(ValueError, swap.build, self.url, self.external)
+        self.assertEqual(self.schemas(), [])
+
+    def test_dependent_view(self):
+        swap.build(self.url, self.external)
+        n = self.count('cow_statelist')
+        self.live.execute("CREATE VIEW irdata_test_view AS "
+                          "SELECT ccode FROM cow_statelist")
+        kept = swap.build(self.url, self.external)
+        self.assertEqual(self.schemas(), [kept])
+        ## The view still reads the previous tables
+        self.assertEqual(self.count('irdata_test_view'), n)
+        self.assertEqual(self.count('cow_statelist'), n)
+
+if __name__ == '__main__':
+    unittest.main()